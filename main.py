@@ -1,8 +1,38 @@
-from typing import List, Dict, Set, Tuple, NamedTuple, Optional, FrozenSet
+from typing import (
+    Callable,
+    List,
+    Dict,
+    Set,
+    Tuple,
+    NamedTuple,
+    Optional,
+    FrozenSet,
+    Iterator,
+    Union,
+)
+from array import array
 import collections
+import contextlib
+import cProfile
+import hashlib
+import io
+import itertools
+import json
+import operator
+import os
+import platform
+import pstats
+import random
+import shlex
+import sqlite3
+import struct
+import threading
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
 import colorama
 from colorama import Fore, Style, Back
-from heapq import nlargest
+from heapq import nlargest, heappush, heappop
 import sys
 import argparse
 
@@ -25,6 +55,10 @@ C_DIM = Style.DIM
 class IngredientAction(NamedTuple):
     effect_to_add: str
     effects_to_remove: List[str]
+    # Guards: the action only happens if none of requires_absent and all of
+    # requires_present are in the product (before the ingredient is added)
+    requires_absent: Tuple[str, ...] = ()
+    requires_present: Tuple[str, ...] = ()
 
 
 # Ingredient name -> List of actions it performs
@@ -50,16 +84,56 @@ INGREDIENTS_DATA: Dict[str, List[str]] = {
     "Viagra": ["Tropic Thunder"],
 }
 
+# --- Ingredient Purchase Costs ($ per unit) ---
+INGREDIENT_COSTS: Dict[str, int] = {
+    "Addy": 9,
+    "Banana": 2,
+    "Battery": 8,
+    "Chili": 7,
+    "Cuke": 2,
+    "Donut": 3,
+    "Energy Drink": 6,
+    "Flu Medicine": 5,
+    "Gasoline": 5,
+    "Horse Semen": 9,
+    "Iodine": 8,
+    "Mega Bean": 7,
+    "Motor Oil": 6,
+    "Mouth Wash": 4,
+    "Paracetamol": 3,
+    "Viagra": 4,
+}
+
 # --- Corrected Transformation Rules ---
 # (Insert the large corrected effects_data dictionary from above here)
 #
 effects_data_from_text = {}
 
 
-def add_rule(target_effect, ingredient, replaced_effects):
-    """Helper to add rules, creating dicts/lists as needed."""
+def add_rule(
+    target_effect,
+    ingredient,
+    replaced_effects,
+    requires_absent=None,
+    requires_present=None,
+):
+    """
+    Helper to add rules, creating dicts/lists as needed.
+    Guarded rules (with requires_absent/requires_present) are kept apart, as
+    they cannot be merged with the other rules for the same target.
+    """
     if target_effect not in effects_data_from_text:
         effects_data_from_text[target_effect] = {"replaces": {}}
+    if requires_absent or requires_present:
+        guarded = effects_data_from_text[target_effect].setdefault("guarded", {})
+        guarded.setdefault(ingredient, []).append(
+            {
+                "replaces": list(replaced_effects),
+                "requires_absent": list(requires_absent or []),
+                "requires_present": list(requires_present or []),
+            }
+        )
+        return
     if ingredient not in effects_data_from_text[target_effect]["replaces"]:
         effects_data_from_text[target_effect]["replaces"][ingredient] = []
 
@@ -111,9 +185,7 @@ add_rule("Focused", "Gasoline", ["Shrinking"])
 add_rule("Spicy", "Gasoline", ["Euphoric"])  # Combine with Energizing rule for Spicy
 
 # Donut
-add_rule(
-    "Explosive", "Donut", ["Calorie-Dense"]
-)  # Ignoring "(and no Explosive)" for now
+add_rule("Explosive", "Donut", ["Calorie-Dense"], requires_absent=["Explosive"])
 add_rule("Sneaky", "Donut", ["Balding"])
 add_rule("Slippery", "Donut", ["Anti-Gravity"])
 add_rule(
@@ -156,8 +228,8 @@ add_rule(
 
 # Banana
 add_rule(
-    "Thought-Provoking", "Banana", ["Energizing"]
-)  # Ignoring "(and no Cyclopean)" Note: Also -> TP if Cyclopean
+    "Thought-Provoking", "Banana", ["Energizing"], requires_absent=["Cyclopean"]
+)  # Note: Also -> TP if Cyclopean
 add_rule("Sneaky", "Banana", ["Calming"])
 add_rule("Smelly", "Banana", ["Toxic"])
 add_rule("Refreshing", "Banana", ["Long-Faced"])
@@ -185,7 +257,7 @@ add_rule("Seizure-Inducing", "Iodine", ["Euphoric"])
 add_rule("Thought-Provoking", "Iodine", ["Refreshing"])
 
 # Paracetamol
-add_rule("Paranoia", "Paracetamol", ["Energizing"])  # Ignoring "(and no Munchies)"
+add_rule("Paranoia", "Paracetamol", ["Energizing"], requires_absent=["Munchies"])
 add_rule("Slippery", "Paracetamol", ["Calming"])
 add_rule("Tropic Thunder", "Paracetamol", ["Toxic"])
 add_rule("Bright-Eyed", "Paracetamol", ["Spicy"])
@@ -204,8 +276,8 @@ add_rule("Toxic", "Viagra", ["Disorienting"])
 
 # Mega Bean
 add_rule(
-    "Cyclopean", "Mega Bean", ["Energizing"]
-)  # Ignoring "(and no Thought-Provoking)" Note: Also -> Cyclopean if TP
+    "Cyclopean", "Mega Bean", ["Energizing"], requires_absent=["Thought-Provoking"]
+)  # Note: Also -> Cyclopean if TP
 add_rule("Glowing", "Mega Bean", ["Calming"])  # Note: Also -> Glowing if Sneaky
 add_rule("Calming", "Mega Bean", ["Sneaky"])
 add_rule("Paranoia", "Mega Bean", ["Jennerising"])
@@ -229,8 +301,8 @@ add_rule("Euphoric", "Addy", ["Explosive"])
 
 # Battery
 add_rule("Tropic Thunder", "Battery", ["Munchies"])
-add_rule("Zombifying", "Battery", ["Euphoric"])  # Ignoring "(and no Electrifying)"
-add_rule("Euphoric", "Battery", ["Electrifying"])  # Ignoring "(and no Zombifying)"
+add_rule("Zombifying", "Battery", ["Euphoric"], requires_absent=["Electrifying"])
+add_rule("Euphoric", "Battery", ["Electrifying"], requires_absent=["Zombifying"])
 add_rule("Calorie-Dense", "Battery", ["Laxative"])
 # add_rule("Euphoric", "Battery", ["Electrifying"]) # Duplicate already handled
 add_rule("Munchies", "Battery", ["Shrinking"])
@@ -351,7 +423,9 @@ def calculate_product_price(
         return None
 
     base_price = BASE_PRICES[base_product_name]
-    sum_of_multipliers = 0.0
+    # Multipliers are summed in exact hundredths so the rounding (e.g. at x.5)
+    # does not depend on the iteration order of the effect set
+    sum_of_multipliers = 0
     unknown_effects_found = []
 
     for effect in final_effects:
@@ -364,9 +438,9 @@ def calculate_product_price(
                 )
                 unknown_effects_found.append(effect)
             multiplier = 0.0
-        sum_of_multipliers += multiplier
+        sum_of_multipliers += round(multiplier * 100)
 
-    final_price = round(base_price * (1.0 + sum_of_multipliers))
+    final_price = round(base_price * (100 + sum_of_multipliers) / 100)
     return final_price
 
 
@@ -388,6 +462,16 @@ def build_ingredient_lookup(data: Dict) -> IngredientLookup:
                 # Avoid adding duplicate actions if data has redundancy
                 if action not in lookup[ingredient]:
                     lookup[ingredient].append(action)
+        for ingredient, rules in effect_data.get("guarded", {}).items():
+            for rule in rules:
+                action = IngredientAction(
+                    effect_to_add=effect_name,
+                    effects_to_remove=rule["replaces"],
+                    requires_absent=tuple(rule["requires_absent"]),
+                    requires_present=tuple(rule["requires_present"]),
+                )
+                if action not in lookup.setdefault(ingredient, []):
+                    lookup[ingredient].append(action)
     return lookup
 
 
@@ -414,6 +498,17 @@ def validate_data_effects(data_dict, context_name, valid_set):
                         errors_found.append(
                             f"Invalid replaced effect '{C_RED}{effect}{C_RESET}' for target '{C_MAGENTA}{target_effect}{C_RESET}' / ingredient '{C_YELLOW}{ingredient}{C_RESET}' in {context_name}."
                         )
+            for ingredient, rules in data.get("guarded", {}).items():
+                for rule in rules:
+                    for effect in (
+                        rule["replaces"]
+                        + rule["requires_absent"]
+                        + rule["requires_present"]
+                    ):
+                        if effect not in valid_set:
+                            errors_found.append(
+                                f"Invalid effect '{C_RED}{effect}{C_RESET}' in guarded rule for target '{C_MAGENTA}{target_effect}{C_RESET}' / ingredient '{C_YELLOW}{ingredient}{C_RESET}' in {context_name}."
+                            )
     else:
         raise ValueError(f"Unknown context for validation: {context_name}")
 
@@ -440,6 +535,26 @@ def validate_data_effects(data_dict, context_name, valid_set):
 ingredient_lookup = build_ingredient_lookup(effects_data)
 
 
+# --- Effect Cap ---
+# A product holds at most this many effects, as in the game: an ingredient
+# added to a full product still transforms its effects, but its base effect is
+# not added. None means no cap. Set it through set_effect_cap, which also drops
+# the tables derived from it.
+DEFAULT_EFFECT_CAP = 8
+EFFECT_CAP: Optional[int] = DEFAULT_EFFECT_CAP
+
+
+def set_effect_cap(cap: Optional[int]):
+    """
+    Changes the effect cap (None or 0 for no cap). Transitions cached or saved
+    under the previous cap (TransitionCache, ValueTable, ...) are not valid
+    afterwards; saved files are rejected through rules_fingerprint.
+    """
+    global EFFECT_CAP
+    EFFECT_CAP = cap or None
+    _commuting_masks_by_size.clear()
+
+
 # --- Optimized Application Logic ---
 
 
@@ -447,16 +562,19 @@ def apply_ingredient_optimized(current_effects: Set[str], ingredient: str) -> Se
     """
     Applies ingredient effects based on the corrected logic using sets.
     1. Stores the initial state (before adding base effects).
-    2. Adds base effects from INGREDIENTS_DATA.
+    2. Adds base effects from INGREDIENTS_DATA, unless the product already
+       holds EFFECT_CAP effects.
     3. Determines transformations based on the *initial* state and the ingredient_lookup.
+       Guards of an action are also checked against the *initial* state.
     4. Applies transformations (removals first, then additions).
     """
     initial_effects_set = current_effects.copy()  # State before this ingredient
     final_effects_set = current_effects.copy()  # Working set, starts same as initial
 
     # 1. Generation Step
-    base_effects_to_add = INGREDIENTS_DATA.get(ingredient, [])
-    final_effects_set.update(base_effects_to_add)
+    if EFFECT_CAP is None or len(initial_effects_set) < EFFECT_CAP:
+        base_effects_to_add = INGREDIENTS_DATA.get(ingredient, [])
+        final_effects_set.update(base_effects_to_add)
 
     # 2. Transformation Step - Identify based on initial state
     possible_actions = ingredient_lookup.get(ingredient, [])
@@ -465,6 +583,14 @@ def apply_ingredient_optimized(current_effects: Set[str], ingredient: str) -> Se
 
     if possible_actions:
         for action in possible_actions:
+            if action.requires_absent and not initial_effects_set.isdisjoint(
+                action.requires_absent
+            ):
+                continue
+            if action.requires_present and not initial_effects_set.issuperset(
+                action.requires_present
+            ):
+                continue
             target_effect = action.effect_to_add
             potential_removals = action.effects_to_remove
 
@@ -491,12 +617,1014 @@ ALL_INGREDIENTS = sorted(
 )  # Get all possible ingredients once
 
 
+# --- Compact State Encoding ---
+# Effect sets are encoded as integer bitmasks (one bit per valid effect, in
+# sorted order) so searches can hash, compare and transform states cheaply.
+EFFECT_NAMES: List[str] = sorted(ALL_VALID_EFFECTS)
+EFFECT_BITS: Dict[str, int] = {effect: 1 << i for i, effect in enumerate(EFFECT_NAMES)}
+
+
+def encode_effects(effects) -> int:
+    """Encodes an iterable of valid effect names as a bitmask."""
+    mask = 0
+    for effect in effects:
+        mask |= EFFECT_BITS[effect]
+    return mask
+
+
+def decode_effects(mask: int) -> Set[str]:
+    """Decodes a bitmask back into the set of effect names it represents."""
+    effects = set()
+    index = 0
+    while mask:
+        if mask & 1:
+            effects.add(EFFECT_NAMES[index])
+        mask >>= 1
+        index += 1
+    return effects
+
+
+# Multiplier of each effect bit in hundredths, see calculate_product_price
+EFFECT_MULTIPLIER_HUNDREDTHS: List[int] = [
+    round(EFFECT_MULTIPLIERS.get(effect, 0.0) * 100) for effect in EFFECT_NAMES
+]
+
+
+def mask_multiplier_hundredths(state: int) -> int:
+    """Sum of the effect multipliers of an encoded state, in hundredths."""
+    sum_of_multipliers = 0
+    index = 0
+    while state:
+        if state & 1:
+            sum_of_multipliers += EFFECT_MULTIPLIER_HUNDREDTHS[index]
+        state >>= 1
+        index += 1
+    return sum_of_multipliers
+
+
+def price_from_hundredths(base_product_name: str, sum_of_multipliers: int) -> int:
+    return round(BASE_PRICES[base_product_name] * (100 + sum_of_multipliers) / 100)
+
+
+def calculate_mask_price(base_product_name: str, state: int) -> int:
+    """Bitmask version of calculate_product_price for a known base product."""
+    return price_from_hundredths(base_product_name, mask_multiplier_hundredths(state))
+
+
+class CompiledIngredient(NamedTuple):
+    base_mask: int  # Base effects the ingredient always adds
+    rules: Tuple[Tuple[int, int], ...]  # (trigger mask, bit of the effect to add)
+    # (trigger mask, bit to add, guard mask, guard value): the rule only fires
+    # when state & guard mask == guard value. Kept apart from the plain rules
+    # so ingredients without guards pay nothing for them.
+    guarded_rules: Tuple[Tuple[int, int, int, int], ...] = ()
+
+
+def compile_ingredient(ingredient: str) -> CompiledIngredient:
+    """Compiles the base effects and lookup actions of an ingredient into masks."""
+    base_mask = encode_effects(INGREDIENTS_DATA.get(ingredient, []))
+    rules = []
+    guarded_rules = []
+    for action in ingredient_lookup.get(ingredient, []):
+        trigger_mask = encode_effects(action.effects_to_remove)
+        effect_bit = EFFECT_BITS[action.effect_to_add]
+        if action.requires_absent or action.requires_present:
+            present_mask = encode_effects(action.requires_present)
+            guard_mask = encode_effects(action.requires_absent) | present_mask
+            guarded_rules.append((trigger_mask, effect_bit, guard_mask, present_mask))
+        else:
+            rules.append((trigger_mask, effect_bit))
+    return CompiledIngredient(
+        base_mask=base_mask, rules=tuple(rules), guarded_rules=tuple(guarded_rules)
+    )
+
+
+# Indexed like ALL_INGREDIENTS
+COMPILED_INGREDIENTS: List[CompiledIngredient] = [
+    compile_ingredient(ingredient) for ingredient in ALL_INGREDIENTS
+]
+INGREDIENT_INDEX: Dict[str, int] = {
+    ingredient: i for i, ingredient in enumerate(ALL_INGREDIENTS)
+}
+
+
+def unsigned_typecode(max_value: int) -> str:
+    """The smallest array typecode holding unsigned values up to max_value."""
+    for typecode in "BHILQ":
+        if max_value < 1 << 8 * array(typecode).itemsize:
+            return typecode
+    raise OverflowError(f"No array typecode holds {max_value}.")
+
+
+# Typecode of arrays holding one bit per ingredient (commutation skip masks)
+INGREDIENT_SET_TYPECODE = unsigned_typecode((1 << len(ALL_INGREDIENTS)) - 1)
+
+
+def rules_fingerprint(prices: bool = True) -> str:
+    """
+    Hash of everything a saved result depends on: the effect and ingredient
+    order, the compiled rules and the multipliers. Saved tables are rejected
+    when it changes.
+
+    Args:
+        prices: Include the multipliers; without them the hash only covers
+                what decides which states are reachable.
+    """
+    parts = [
+        EFFECT_NAMES,
+        ALL_INGREDIENTS,
+        [
+            [c.base_mask, list(map(list, c.rules)), list(map(list, c.guarded_rules))]
+            for c in COMPILED_INGREDIENTS
+        ],
+        EFFECT_MULTIPLIER_HUNDREDTHS,
+        EFFECT_CAP,
+    ]
+    if not prices:
+        del parts[3]
+    payload = json.dumps(parts)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def apply_ingredient_mask(state: int, compiled: CompiledIngredient) -> int:
+    """
+    Bitmask equivalent of apply_ingredient_optimized.
+    Triggers are matched against the state before the ingredient, removals are
+    applied after the base effects are added, and additions last.
+    """
+    base_mask = compiled.base_mask
+    # The effect count only matters when the base effects are not all present
+    if (
+        base_mask & ~state
+        and EFFECT_CAP is not None
+        and bin(state).count("1") >= EFFECT_CAP
+    ):
+        base_mask = 0
+    removed = 0
+    added = 0
+    for trigger_mask, effect_bit in compiled.rules:
+        hit = state & trigger_mask
+        if hit:
+            removed |= hit
+            added |= effect_bit
+    for trigger_mask, effect_bit, guard_mask, guard_value in compiled.guarded_rules:
+        hit = state & trigger_mask
+        if hit and state & guard_mask == guard_value:
+            removed |= hit
+            added |= effect_bit
+    return ((state | base_mask) & ~removed) | added
+
+
+class TransitionCache:
+    """
+    Memoizes the successors of encoded states (one per ingredient, in
+    ALL_INGREDIENTS order) so several searches can share transition work.
+    Successors are computed lazily, so skipped edges cost nothing.
+    """
+
+    def __init__(self):
+        self._rows: Dict[int, List[Optional[int]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def apply(self, state: int, ingredient_index: int) -> int:
+        row = self._rows.get(state)
+        if row is None:
+            row = self._rows[state] = [None] * len(COMPILED_INGREDIENTS)
+        next_state = row[ingredient_index]
+        if next_state is None:
+            self.misses += 1
+            next_state = row[ingredient_index] = apply_ingredient_mask(
+                state, COMPILED_INGREDIENTS[ingredient_index]
+            )
+        else:
+            self.hits += 1
+        return next_state
+
+    def successors(self, state: int) -> Tuple[int, ...]:
+        return tuple(self.apply(state, i) for i in range(len(COMPILED_INGREDIENTS)))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class VisitedTable:
+    """
+    Open-addressing hash set of encoded states, with parallel compact arrays
+    for the depth, parent entry and ingredient that first reached each state.
+
+    Entries are numbered in insertion order. The hash index (linear probing,
+    kept at most half full) only stores entry numbers + 1, with 0 marking an
+    empty slot. Growing it never moves entries, so parent links stay valid.
+    That is about 25 bytes per state, against a few hundred for a frozenset
+    of effect names held in a set.
+    """
+
+    _HASH_MULTIPLIER = 0x9E3779B97F4A7C15  # Fibonacci hashing
+
+    def __init__(self, capacity: int = 1024, max_depth: int = 255):
+        self._bits = max(4, (2 * capacity - 1).bit_length())
+        self._index = array("I", bytes(4 << self._bits))
+        self.states = array("Q")
+        self.depths = array(unsigned_typecode(max_depth))
+        self.parents = array("i")  # Entry number, -1 for roots
+        self.ingredients = array("b")  # Index into ALL_INGREDIENTS, -1 for roots
+
+    def _find_slot(self, state: int) -> int:
+        """Slot holding the state, or the empty slot where it belongs."""
+        index = self._index
+        states = self.states
+        slot_mask = (1 << self._bits) - 1
+        slot = ((state * self._HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> (
+            64 - self._bits
+        )
+        while True:
+            entry = index[slot]
+            if not entry or states[entry - 1] == state:
+                return slot
+            slot = (slot + 1) & slot_mask
+
+    def get(self, state: int) -> int:
+        """The entry number of a state, or -1 if it was never inserted."""
+        return self._index[self._find_slot(state)] - 1
+
+    def insert(
+        self, state: int, depth: int, parent: int = -1, ingredient: int = -1
+    ) -> Tuple[int, bool]:
+        """
+        Inserts a state unless present. Depths above the table's max_depth
+        may not fit the depths column and raise OverflowError.
+
+        Returns:
+            (entry number, whether the state was new). The depth, parent and
+            ingredient of a state already present are left unchanged.
+        """
+        slot = self._find_slot(state)
+        entry = self._index[slot]
+        if entry:
+            return entry - 1, False
+        entry = len(self.states)
+        self.states.append(state)
+        self.depths.append(depth)
+        self.parents.append(parent)
+        self.ingredients.append(ingredient)
+        self._index[slot] = entry + 1
+        if 2 * len(self.states) > len(self._index):
+            self._grow()
+        return entry, True
+
+    def _grow(self):
+        self._bits += 1
+        self._index = array("I", bytes(4 << self._bits))
+        for entry, state in enumerate(self.states):
+            self._index[self._find_slot(state)] = entry + 1
+
+    def path(self, entry: int) -> List[int]:
+        """Ingredient indices from the root to an entry."""
+        path = []
+        while self.parents[entry] >= 0:
+            path.append(self.ingredients[entry])
+            entry = self.parents[entry]
+        path.reverse()
+        return path
+
+    def nbytes(self) -> int:
+        return sum(
+            len(data) * data.itemsize
+            for data in (
+                self._index,
+                self.states,
+                self.depths,
+                self.parents,
+                self.ingredients,
+            )
+        )
+
+    def __contains__(self, state: int) -> bool:
+        return self.get(state) >= 0
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+
+# --- Ingredient Interaction Analysis ---
+# Precomputed from ingredient_lookup so the searches can drop redundant edges
+# before paying for the apply and hash work:
+#  * No-op edges: the ingredient's base effects are already present and none of
+#    the effects it reads (triggers and guards) are, so the state comes back
+#    unchanged.
+#  * Commuting pairs: neither ingredient writes an effect the other reads, so
+#    both orders give the same state and only one order needs expanding.
+# Under the effect cap an ingredient also reads the effect count. A full
+# product turns more edges into no-ops, and a pair only commutes from states
+# small enough that neither order reaches the cap.
+
+
+class IngredientInteractions(NamedTuple):
+    base_effects: Dict[str, FrozenSet[str]]
+    reads: Dict[str, FrozenSet[str]]  # Effects that trigger the ingredient's rules
+    writes: Dict[str, FrozenSet[str]]  # Effects the ingredient may add or remove
+    commutes_with: Dict[str, FrozenSet[str]]
+    # Mask forms, indexed like ALL_INGREDIENTS
+    read_masks: List[int]
+    # Bit j is set when ALL_INGREDIENTS[j] (j < i) commutes with ALL_INGREDIENTS[i]
+    commuting_predecessors: List[int]
+    # Most effects one application can add (an exact upper bound, see
+    # ingredient_max_growth)
+    max_growth: List[int]
+    # Lower bound on the growth, negative when effects are taken away. Not
+    # the true minimum and not derived like max_growth (see
+    # ingredient_min_growth); only use it where a loose lower bound is enough.
+    min_growth: List[int]
+
+
+def ingredient_max_growth(compiled: CompiledIngredient, read_mask: int) -> int:
+    """
+    Most effects one application of the ingredient can add to a product.
+
+    Exact, and an upper bound for every state: effects outside what the
+    ingredient reads can only make its growth smaller (a rule target or base
+    effect already present adds nothing), so trying every subset of its reads
+    finds the maximum. Safe for reasoning about when a product can reach the
+    effect cap, as commuting_predecessor_masks does.
+    """
+    read_bits = [1 << b for b in range(len(EFFECT_NAMES)) if read_mask >> b & 1]
+    growth = 0
+    for r in range(len(read_bits) + 1):
+        for bits in itertools.combinations(read_bits, r):
+            state = sum(bits)
+            removed = added = 0
+            for trigger_mask, effect_bit in compiled.rules:
+                if state & trigger_mask:
+                    removed |= state & trigger_mask
+                    added |= effect_bit
+            for trigger_mask, effect_bit, guard_mask, guard_value in compiled.guarded_rules:
+                if state & trigger_mask and state & guard_mask == guard_value:
+                    removed |= state & trigger_mask
+                    added |= effect_bit
+            next_state = ((state | compiled.base_mask) & ~removed) | added
+            growth = max(growth, bin(next_state).count("1") - r)
+    return growth
+
+
+def ingredient_min_growth(compiled: CompiledIngredient) -> int:
+    """
+    Lower bound on the growth of one application (negative when effects are
+    taken away). Only a bound, usually below the true minimum.
+
+    It cannot be found like ingredient_max_growth: over subsets of the reads
+    every rule target counts as newly added, while on a real product it may
+    already be present, or several triggers may collapse into one target. An
+    application only takes away effects matching a trigger, so minus the
+    number of trigger effects is sound.
+    """
+    trigger_mask = 0
+    for rule in compiled.rules + compiled.guarded_rules:
+        trigger_mask |= rule[0]
+    return -bin(trigger_mask).count("1")
+
+
+def analyze_ingredient_lookup(lookup: IngredientLookup) -> IngredientInteractions:
+    """Computes the no-op and commutation tables for the ingredient lookup."""
+    base_effects: Dict[str, FrozenSet[str]] = {}
+    reads: Dict[str, FrozenSet[str]] = {}
+    writes: Dict[str, FrozenSet[str]] = {}
+    for ingredient in ALL_INGREDIENTS:
+        triggers: Set[str] = set()
+        targets: Set[str] = set()
+        guards: Set[str] = set()
+        for action in lookup.get(ingredient, []):
+            triggers.update(action.effects_to_remove)
+            targets.add(action.effect_to_add)
+            guards.update(action.requires_absent, action.requires_present)
+        base_effects[ingredient] = frozenset(INGREDIENTS_DATA.get(ingredient, []))
+        # Guard effects are read too: they decide whether an action happens
+        reads[ingredient] = frozenset(triggers | guards)
+        writes[ingredient] = frozenset(triggers | targets | base_effects[ingredient])
+
+    # Applying a then b equals b then a when neither can change what the other
+    # reacts to: a's removals and additions only depend on a's triggers.
+    commutes_with: Dict[str, FrozenSet[str]] = {}
+    for a in ALL_INGREDIENTS:
+        commutes_with[a] = frozenset(
+            b
+            for b in ALL_INGREDIENTS
+            if b != a
+            and writes[a].isdisjoint(reads[b])
+            and writes[b].isdisjoint(reads[a])
+        )
+
+    read_masks = [encode_effects(reads[ingredient]) for ingredient in ALL_INGREDIENTS]
+    commuting_predecessors = []
+    for i, ingredient in enumerate(ALL_INGREDIENTS):
+        mask = 0
+        for j in range(i):
+            if ALL_INGREDIENTS[j] in commutes_with[ingredient]:
+                mask |= 1 << j
+        commuting_predecessors.append(mask)
+
+    max_growth = [
+        ingredient_max_growth(compiled, read_masks[i])
+        for i, compiled in enumerate(COMPILED_INGREDIENTS)
+    ]
+    min_growth = [ingredient_min_growth(compiled) for compiled in COMPILED_INGREDIENTS]
+
+    return IngredientInteractions(
+        base_effects=base_effects,
+        reads=reads,
+        writes=writes,
+        commutes_with=commutes_with,
+        read_masks=read_masks,
+        commuting_predecessors=commuting_predecessors,
+        max_growth=max_growth,
+        min_growth=min_growth,
+    )
+
+
+INGREDIENT_INTERACTIONS = analyze_ingredient_lookup(ingredient_lookup)
+
+
+def is_noop_ingredient(effects: FrozenSet[str], ingredient: str) -> bool:
+    """True when applying the ingredient would leave the effects unchanged."""
+    return effects.isdisjoint(INGREDIENT_INTERACTIONS.reads[ingredient]) and (
+        INGREDIENT_INTERACTIONS.base_effects[ingredient] <= effects
+        or (EFFECT_CAP is not None and len(effects) >= EFFECT_CAP)
+    )
+
+
+def is_noop_ingredient_mask(state: int, ingredient_index: int) -> bool:
+    """Bitmask version of is_noop_ingredient."""
+    if state & INGREDIENT_INTERACTIONS.read_masks[ingredient_index]:
+        return False
+    base_mask = COMPILED_INGREDIENTS[ingredient_index].base_mask
+    return state & base_mask == base_mask or (
+        EFFECT_CAP is not None and bin(state).count("1") >= EFFECT_CAP
+    )
+
+
+# (effect cap, effect count) -> commuting predecessors per ingredient
+_commuting_masks_by_size: Dict[Tuple[Optional[int], int], List[int]] = {}
+
+
+def commuting_predecessor_masks(num_effects: int) -> List[int]:
+    """
+    INGREDIENT_INTERACTIONS.commuting_predecessors, restricted to the pairs
+    that still commute from a product with num_effects effects: both
+    ingredients must add their base effects in either order, so neither may
+    be able to bring the product up to the effect cap.
+
+    This relies on max_growth being an upper bound on the growth from any
+    state; min_growth is no substitute for it.
+    """
+    if EFFECT_CAP is None:
+        return INGREDIENT_INTERACTIONS.commuting_predecessors
+    key = (EFFECT_CAP, num_effects)
+    masks = _commuting_masks_by_size.get(key)
+    if masks is None:
+        growth = INGREDIENT_INTERACTIONS.max_growth
+        masks = []
+        for a, predecessors in enumerate(INGREDIENT_INTERACTIONS.commuting_predecessors):
+            mask = 0
+            for b in range(a):
+                if (
+                    predecessors >> b & 1
+                    and num_effects + max(growth[a], growth[b]) < EFFECT_CAP
+                ):
+                    mask |= 1 << b
+            masks.append(mask)
+        _commuting_masks_by_size[key] = masks
+    return masks
+
+
+# Skipping commuting orders stays exact for BFS as long as a state only skips
+# ingredient x when *every* edge that first reached it (at its minimum depth)
+# came from an ingredient y that commutes with x and sorts after it: the
+# reordered sequence then reaches the same state at the same depth. Searches
+# keep that per-state "skip mask" by AND-ing the commuting_predecessors of each
+# same-depth incoming edge. Most masks are 0, so only non-zero ones are stored.
+
+
+# --- Reverse Transition Index ---
+# For the backward half of the bidirectional search. A set of states is kept
+# as a "cube": the states with all `ones` bits set, none of the `zeros` bits
+# and an effect count in [min_effects, max_effects]. The states an ingredient
+# takes into a cube are again a union of disjoint cubes, found by splitting
+# on one input bit at a time until every required result bit is decided.
+# Result bit b only depends on the input bits in its support: b itself, the
+# triggers and guards of the rules adding b, and the guards of the rules
+# removing it.
+
+
+class ReverseRules(NamedTuple):
+    # Per effect bit: (trigger mask, guard mask, guard value) of each rule adding it
+    adders: List[Tuple[Tuple[int, int, int], ...]]
+    # Per effect bit: (guard mask, guard value) of each rule removing it when present
+    removers: List[Tuple[Tuple[int, int], ...]]
+    # Per effect bit: the input bits the resulting bit depends on
+    support: List[int]
+
+
+def build_reverse_transition_index() -> List[ReverseRules]:
+    """Builds the ReverseRules of each compiled ingredient, indexed like ALL_INGREDIENTS."""
+    index = []
+    for compiled in COMPILED_INGREDIENTS:
+        adders: List[List[Tuple[int, int, int]]] = [[] for _ in EFFECT_NAMES]
+        removers: List[List[Tuple[int, int]]] = [[] for _ in EFFECT_NAMES]
+        support = [1 << b for b in range(len(EFFECT_NAMES))]
+        guarded = [(t, bit, 0, 0) for t, bit in compiled.rules]
+        for trigger_mask, effect_bit, guard_mask, guard_value in (
+            guarded + list(compiled.guarded_rules)
+        ):
+            target = effect_bit.bit_length() - 1
+            adders[target].append((trigger_mask, guard_mask, guard_value))
+            support[target] |= trigger_mask | guard_mask
+            for b in range(len(EFFECT_NAMES)):
+                if trigger_mask >> b & 1:
+                    removers[b].append((guard_mask, guard_value))
+                    support[b] |= guard_mask
+        index.append(
+            ReverseRules(
+                adders=[tuple(rules) for rules in adders],
+                removers=[tuple(rules) for rules in removers],
+                support=support,
+            )
+        )
+    return index
+
+
+REVERSE_TRANSITION_INDEX = build_reverse_transition_index()
+
+
+def _guard_holds(ones: int, zeros: int, guard_mask: int, guard_value: int) -> Optional[bool]:
+    """Whether state & guard_mask == guard_value for every state of a cube, None if it depends."""
+    if ones & guard_mask & ~guard_value or zeros & guard_value:
+        return False
+    if guard_mask & ~(ones | zeros):
+        return None
+    return True
+
+
+def _result_bit(
+    reverse: ReverseRules, b: int, ones: int, zeros: int, base_mask: int
+) -> Optional[bool]:
+    """
+    Bit b of the ingredient's result for every state of the cube (ones, zeros),
+    or None when bits the cube leaves open decide it. base_mask is what the
+    ingredient adds, 0 when the product is full (see EFFECT_CAP).
+    """
+    bit = 1 << b
+    added = False
+    for trigger_mask, guard_mask, guard_value in reverse.adders[b]:
+        if not trigger_mask & ~zeros:
+            continue  # No trigger can be present
+        guard = _guard_holds(ones, zeros, guard_mask, guard_value) if guard_mask else True
+        if guard is False:
+            continue
+        if guard and ones & trigger_mask:
+            return True
+        added = None
+
+    # Whether a rule reading bit b fires once b is known to be present
+    removed: Optional[bool] = False
+    for guard_mask, guard_value in reverse.removers[b]:
+        guard = _guard_holds(ones, zeros, guard_mask, guard_value) if guard_mask else True
+        if guard:
+            removed = True
+            break
+        if guard is None:
+            removed = None
+
+    if ones & bit:
+        kept = None if removed is None else not removed
+    elif zeros & bit:
+        kept = bool(base_mask & bit)
+    elif base_mask & bit:
+        kept = True if removed is False else None
+    else:
+        kept = False if removed is True else None
+
+    if kept:
+        return True
+    if kept is False and added is False:
+        return False
+    return None
+
+
+def preimage_cubes(
+    ones_required: int, zeros_required: int, ingredient_index: int, base_mask: int
+) -> List[Tuple[int, int]]:
+    """
+    States the ingredient turns into a result with all ones_required bits and
+    none of the zeros_required bits.
+
+    Args:
+        ones_required: Bits the result must have.
+        zeros_required: Bits the result must not have.
+        ingredient_index: Index into ALL_INGREDIENTS.
+        base_mask: The base effects the ingredient adds; 0 for a full product.
+
+    Returns:
+        Disjoint (ones, zeros) cubes covering exactly those states.
+    """
+    if ones_required & zeros_required:
+        return []
+    reverse = REVERSE_TRANSITION_INDEX[ingredient_index]
+    required = ones_required | zeros_required
+    required_bits = [b for b in range(len(EFFECT_NAMES)) if required >> b & 1]
+    cubes = []
+    pending = [(0, 0)]
+    while pending:
+        ones, zeros = pending.pop()
+        undecided = -1
+        for b in required_bits:
+            result = _result_bit(reverse, b, ones, zeros, base_mask)
+            if result is None:
+                if undecided < 0:
+                    undecided = b
+            elif result != bool(ones_required >> b & 1):
+                break
+        else:
+            if undecided < 0:
+                cubes.append((ones, zeros))
+            else:
+                free = reverse.support[undecided] & ~(ones | zeros)
+                split = free & -free
+                pending.append((ones, zeros | split))
+                pending.append((ones | split, zeros))
+    return cubes
+
+
+# --- Search Constraints ---
+# Constraints are checked inside the expansion loops: banned ingredients are
+# never applied, and states that can no longer lead to an acceptable product
+# are never enqueued. An excluded effect only rules a state out once no
+# allowed ingredient can remove it again, so recipes may still pass through
+# e.g. Toxic on their way to a clean product.
+
+
+class SearchConstraints(NamedTuple):
+    excluded_effects: FrozenSet[str] = frozenset()
+    banned_ingredients: FrozenSet[str] = frozenset()
+    max_effects: Optional[int] = None
+    # Effects no allowed ingredient can remove once present
+    permanent_effects: FrozenSet[str] = frozenset()
+    # Mask forms of the above, for the bitmask searches
+    excluded_mask: int = 0
+    permanent_mask: int = 0
+
+    def allows_final(self, effects) -> bool:
+        """True when a final product with these effects satisfies the constraints."""
+        return self.excluded_effects.isdisjoint(effects) and (
+            self.max_effects is None or len(effects) <= self.max_effects
+        )
+
+    def is_dead_end(self, effects: FrozenSet[str]) -> bool:
+        """True when no continuation of this state can satisfy the constraints."""
+        permanent = self.permanent_effects & effects
+        if not self.excluded_effects.isdisjoint(permanent):
+            return True
+        return self.max_effects is not None and len(permanent) > self.max_effects
+
+    def allows_final_mask(self, state: int) -> bool:
+        return not state & self.excluded_mask and (
+            self.max_effects is None or bin(state).count("1") <= self.max_effects
+        )
+
+    def is_dead_end_mask(self, state: int) -> bool:
+        permanent = state & self.permanent_mask
+        if permanent & self.excluded_mask:
+            return True
+        return (
+            self.max_effects is not None
+            and bin(permanent).count("1") > self.max_effects
+        )
+
+    def describe(self) -> List[str]:
+        """Human readable summary lines, empty when unconstrained."""
+        lines = []
+        if self.excluded_effects:
+            lines.append(f"Excluded Effects: {sorted(self.excluded_effects)}")
+        if self.banned_ingredients:
+            lines.append(f"Banned Ingredients: {sorted(self.banned_ingredients)}")
+        if self.max_effects is not None:
+            lines.append(f"Max Effects: {self.max_effects}")
+        return lines
+
+
+def build_search_constraints(
+    exclude_effects: Optional[List[str]] = None,
+    ban_ingredients: Optional[List[str]] = None,
+    max_effects: Optional[int] = None,
+) -> SearchConstraints:
+    """Validates the constraint inputs (ignoring invalid names) and precomputes them."""
+    invalid = [eff for eff in exclude_effects or [] if eff not in ALL_VALID_EFFECTS]
+    if invalid:
+        print(
+            f"{C_YELLOW}Warning:{C_RESET} Invalid excluded effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+        )
+    invalid = [ing for ing in ban_ingredients or [] if ing not in ALL_INGREDIENTS]
+    if invalid:
+        print(
+            f"{C_YELLOW}Warning:{C_RESET} Invalid banned ingredients provided and ignored: {C_RED}{invalid}{C_RESET}"
+        )
+    excluded = frozenset(
+        eff for eff in exclude_effects or [] if eff in ALL_VALID_EFFECTS
+    )
+    banned = frozenset(ing for ing in ban_ingredients or [] if ing in ALL_INGREDIENTS)
+
+    removable: Set[str] = set()
+    for ingredient in ALL_INGREDIENTS:
+        if ingredient not in banned:
+            for action in ingredient_lookup.get(ingredient, []):
+                removable.update(action.effects_to_remove)
+    permanent = frozenset(ALL_VALID_EFFECTS - removable)
+
+    return SearchConstraints(
+        excluded_effects=excluded,
+        banned_ingredients=banned,
+        max_effects=max_effects,
+        permanent_effects=permanent,
+        excluded_mask=encode_effects(excluded),
+        permanent_mask=encode_effects(permanent),
+    )
+
+
+# Expanding a backward cube costs about this many forward states (measured)
+BACKWARD_EXPANSION_COST = 10
+
+
+def find_shortest_sequence_bidirectional(
+    start_state: int,
+    target_mask: int,
+    constraints: SearchConstraints,
+    max_ingredients: int,
+) -> Optional[List[int]]:
+    """
+    Bidirectional version of the search in find_shortest_product_sequence.
+    A forward BFS over states from the start and a backward BFS over cubes
+    from the goal region (see preimage_cubes) each grow the side that is
+    cheaper to expand, until a forward state lies in a backward cube.
+
+    Cubes derived from an effect-count condition (the effect cap, or
+    max_effects) only bound that count loosely; their meets are confirmed by
+    replaying the suffix, and they are never used to drop other cubes.
+
+    Args:
+        start_state: The encoded starting effects.
+        target_mask: The encoded effects the product must contain.
+        constraints: As built by build_search_constraints.
+        max_ingredients: The maximum number of ingredients to add.
+
+    Returns:
+        A shortest sequence as indices into ALL_INGREDIENTS, or None if
+        there is none within max_ingredients.
+    """
+    num_effects = len(EFFECT_NAMES)
+    banned = {INGREDIENT_INDEX[ingredient] for ingredient in constraints.banned_ingredients}
+    usable = [i for i in range(len(ALL_INGREDIENTS)) if i not in banned]
+    if constraints.is_dead_end_mask(start_state):
+        return None
+
+    def is_goal(state: int) -> bool:
+        return state & target_mask == target_mask and constraints.allows_final_mask(
+            state
+        )
+
+    # --- Forward side: states in BFS order, with bit columns per effect and
+    # per effect count over the live entries (dead ends never meet a cube)
+    visited = VisitedTable(max_depth=max_ingredients)
+    visited.insert(start_state, 0)
+    skip_masks = array(INGREDIENT_SET_TYPECODE, [0])
+    effect_columns = [bytearray(1) for _ in range(num_effects)]
+    count_columns = [bytearray(1) for _ in range(num_effects + 1)]
+    live_column = bytearray(1)
+
+    def index_entries(entries: List[int]):
+        size = (len(visited) + 7) >> 3
+        for column in itertools.chain(effect_columns, count_columns, [live_column]):
+            column.extend(bytes(size - len(column)))
+        for entry in entries:
+            state = visited.states[entry]
+            byte, bit = entry >> 3, 1 << (entry & 7)
+            live_column[byte] |= bit
+            count_columns[bin(state).count("1")][byte] |= bit
+            while state:
+                low = state & -state
+                effect_columns[low.bit_length() - 1][byte] |= bit
+                state ^= low
+
+    # --- Backward side: cubes (ones, zeros, min/max effect count) in BFS order
+    goal_high = num_effects
+    if constraints.max_effects is not None:
+        goal_high = min(goal_high, constraints.max_effects)
+    cube_ones = [target_mask]
+    cube_zeros = [constraints.excluded_mask]
+    cube_low = array(unsigned_typecode(num_effects), [0])
+    cube_high = array(unsigned_typecode(num_effects), [goal_high])
+    cube_exact = bytearray([True])
+    cube_depths = array(unsigned_typecode(max_ingredients), [0])
+    cube_parents = array("i", [-1])
+    cube_ingredients = array("b", [-1])
+    exact_keys = {(target_mask, constraints.excluded_mask, 0, goal_high)}
+
+    def contains(outer: int, ones: int, zeros: int, low: int, high: int) -> bool:
+        return (
+            ones & cube_ones[outer] == cube_ones[outer]
+            and zeros & cube_zeros[outer] == cube_zeros[outer]
+            and cube_low[outer] <= low
+            and high <= cube_high[outer]
+        )
+
+    def suffix(cube: int) -> List[int]:
+        ingredients = []
+        while cube_parents[cube] >= 0:
+            ingredients.append(cube_ingredients[cube])
+            cube = cube_parents[cube]
+        return ingredients
+
+    def meeting_entry(cube: int, candidates: int) -> int:
+        """Lowest (so shallowest) candidate entry in the cube, -1 if none."""
+        ones = cube_ones[cube]
+        while ones and candidates:
+            low = ones & -ones
+            candidates &= effect_bits[low.bit_length() - 1]
+            ones ^= low
+        zeros = cube_zeros[cube]
+        while zeros and candidates:
+            low = zeros & -zeros
+            candidates &= ~effect_bits[low.bit_length() - 1]
+            zeros ^= low
+        if candidates and (cube_low[cube] > 0 or cube_high[cube] < num_effects):
+            in_range = 0
+            for count in range(cube_low[cube], cube_high[cube] + 1):
+                in_range |= count_bits[count]
+            candidates &= in_range
+        if cube_exact[cube]:
+            return (candidates & -candidates).bit_length() - 1
+        steps = [COMPILED_INGREDIENTS[i] for i in suffix(cube)]
+        while candidates:
+            low = candidates & -candidates
+            entry = low.bit_length() - 1
+            state = visited.states[entry]
+            for compiled in steps:
+                state = apply_ingredient_mask(state, compiled)
+            if is_goal(state):
+                return entry
+            candidates ^= low
+        return -1
+
+    best: Optional[Tuple[int, int, int]] = None  # (length, entry, cube)
+
+    def check(cubes: range, candidates: int):
+        nonlocal best
+        for cube in cubes:
+            entry = meeting_entry(cube, candidates)
+            if entry >= 0:
+                meet = (visited.depths[entry] + cube_depths[cube], entry, cube)
+                if best is None or meet < best:
+                    best = meet
+
+    forward_frontier = [0]
+    backward_frontier = range(1)
+    forward_depth = backward_depth = 0
+    index_entries(forward_frontier)
+    effect_bits = [int.from_bytes(column, "little") for column in effect_columns]
+    count_bits = [int.from_bytes(column, "little") for column in count_columns]
+    live_bits = 1
+    check(backward_frontier, live_bits)
+
+    while (
+        best is None
+        and forward_depth + backward_depth < max_ingredients
+        and forward_frontier
+        and backward_frontier
+    ):
+        if len(backward_frontier) * BACKWARD_EXPANSION_COST < len(forward_frontier):
+            # --- Expand the backward side by one level ---
+            first_cube = len(cube_ones)
+            for cube in backward_frontier:
+                ones_q, zeros_q = cube_ones[cube], cube_zeros[cube]
+                counted = cube_low[cube] > 0 or cube_high[cube] < num_effects
+                for i in usable:
+                    if counted:
+                        # The count before the ingredient is only bounded
+                        low = max(0, cube_low[cube] - INGREDIENT_INTERACTIONS.max_growth[i])
+                        high = min(
+                            num_effects,
+                            cube_high[cube] - INGREDIENT_INTERACTIONS.min_growth[i],
+                        )
+                    else:
+                        low, high = 0, num_effects
+                    base_mask = COMPILED_INGREDIENTS[i].base_mask
+                    if EFFECT_CAP is None or not base_mask:
+                        branches = [(base_mask, low, high)]
+                    else:
+                        branches = [
+                            (base_mask, low, min(high, EFFECT_CAP - 1)),
+                            (0, max(low, EFFECT_CAP), high),
+                        ]
+                    found: Dict[Tuple[int, int], List[int]] = {}
+                    for branch_base, branch_low, branch_high in branches:
+                        if branch_low > branch_high:
+                            continue
+                        for ones, zeros in preimage_cubes(ones_q, zeros_q, i, branch_base):
+                            bounds = found.get((ones, zeros))
+                            if bounds is None:
+                                found[ones, zeros] = [branch_low, branch_high]
+                            else:  # Same cube below and at the cap: adjacent ranges
+                                bounds[0] = min(bounds[0], branch_low)
+                                bounds[1] = max(bounds[1], branch_high)
+                    exact = cube_exact[cube] and not counted
+                    for (ones, zeros), (low, high) in found.items():
+                        if (
+                            bin(ones).count("1") > high
+                            or num_effects - bin(zeros).count("1") < low
+                        ):
+                            continue
+                        # States already a shorter way from the goal
+                        if contains(0, ones, zeros, low, high) or (
+                            cube_exact[cube] and contains(cube, ones, zeros, low, high)
+                        ):
+                            continue
+                        key = (ones, zeros, low, high)
+                        if key in exact_keys:
+                            continue
+                        if exact:
+                            exact_keys.add(key)
+                        cube_ones.append(ones)
+                        cube_zeros.append(zeros)
+                        cube_low.append(low)
+                        cube_high.append(high)
+                        cube_exact.append(exact)
+                        cube_depths.append(backward_depth + 1)
+                        cube_parents.append(cube)
+                        cube_ingredients.append(i)
+            backward_depth += 1
+            backward_frontier = range(first_cube, len(cube_ones))
+            check(backward_frontier, live_bits)
+        else:
+            # --- Expand the forward side by one level ---
+            first_entry = len(visited)
+            next_frontier = []
+            for entry in forward_frontier:
+                state = visited.states[entry]
+                commuting_predecessors = commuting_predecessor_masks(bin(state).count("1"))
+                skip_mask = skip_masks[entry]
+                for i in usable:
+                    if skip_mask >> i & 1 or is_noop_ingredient_mask(state, i):
+                        continue
+                    next_state = apply_ingredient_mask(state, COMPILED_INGREDIENTS[i])
+                    next_entry, is_new = visited.insert(
+                        next_state, forward_depth + 1, entry, i
+                    )
+                    if is_new:
+                        skip_masks.append(commuting_predecessors[i])
+                        if not constraints.is_dead_end_mask(next_state):
+                            next_frontier.append(next_entry)
+                    elif (
+                        visited.depths[next_entry] == forward_depth + 1
+                        and skip_masks[next_entry]
+                    ):
+                        skip_masks[next_entry] &= commuting_predecessors[i]
+            forward_depth += 1
+            forward_frontier = next_frontier
+            index_entries(forward_frontier)
+            effect_bits = [int.from_bytes(column, "little") for column in effect_columns]
+            count_bits = [int.from_bytes(column, "little") for column in count_columns]
+            live_bits = int.from_bytes(live_column, "little")
+            check(range(len(cube_ones)), live_bits >> first_entry << first_entry)
+
+    print(
+        f"{C_DIM}Bidirectional search: {len(visited)} states forward (depth {forward_depth}), "
+        f"{len(cube_ones)} cubes backward (depth {backward_depth}).{C_RESET}"
+    )
+    if best is None:
+        return None
+    _, entry, cube = best
+    return visited.path(entry) + suffix(cube)
+
+
+def print_shortest_solution(sequence: List[str], effects: Set[str]):
+    """Prints a solution found by find_shortest_product_sequence."""
+    # Format ingredient list with color
+    seq_str = f"[{', '.join(f'{C_CYAN}{ing}{C_RESET}' for ing in sequence)}]"
+    print(f"\n{C_GREEN}Solution Found!{C_RESET}")
+    print(
+        f"  Sequence ({C_MAGENTA}{len(sequence)}{C_RESET} added ingredients): {seq_str}"
+    )
+    print(f"  Resulting Effects: {C_DIM}{sorted(effects)}{C_RESET}")
+
+
 def find_shortest_product_sequence(
     target_effects: List[str],
     starting_effects: Optional[List[str]] = None,
     product_name: Optional[str] = None,
     max_ingredients: int = 8,
     debug_specific_sequence: Optional[List[str]] = None,
+    exclude_effects: Optional[List[str]] = None,
+    ban_ingredients: Optional[List[str]] = None,
+    max_effects: Optional[int] = None,
+    bidirectional: bool = False,
 ) -> Optional[List[str]]:
     """
     Finds the shortest sequence of additional ingredients (up to max_ingredients)
@@ -511,6 +1639,13 @@ def find_shortest_product_sequence(
         max_ingredients: The maximum number of *additional* ingredients allowed.
         debug_specific_sequence: If provided, prints detailed info only for
                                  steps along this exact sequence path.
+        exclude_effects: Effects the final product must not have.
+        ban_ingredients: Ingredients that may not be used.
+        max_effects: The maximum number of effects of the final product.
+        bidirectional: Search from both ends at once with
+                       find_shortest_sequence_bidirectional. The sequence
+                       found may differ, its length does not.
+                       debug_specific_sequence is not traced in this mode.
 
     Returns:
         The shortest list of additional ingredients if a solution is found
@@ -556,7 +1691,9 @@ def find_shortest_product_sequence(
             valid_starting_effects
         )  # Use only valid starting effects
 
-    initial_effects_frozen = frozenset(initial_effects_set)
+    constraints = build_search_constraints(
+        exclude_effects, ban_ingredients, max_effects
+    )
 
     # --- Determine Starting product Display Name ---
     start_display_name = (
@@ -574,9 +1711,13 @@ def find_shortest_product_sequence(
             f"    {C_DIM}Contains Effects: {sorted(list(initial_effects_set))}{C_RESET}"
         )
     print(f"  Target Effects:  {C_YELLOW}{sorted(list(target_set))}{C_RESET}")
+    for line in constraints.describe():
+        print(f"  {line}")
 
     # --- Initial Check ---
-    if target_set.issubset(initial_effects_set):
+    if target_set.issubset(initial_effects_set) and constraints.allows_final(
+        initial_effects_set
+    ):
         print(
             f"\n{C_GREEN}Starting product '{start_display_name}' already meets the target criteria.{C_RESET}"
         )
@@ -588,91 +1729,136 @@ def find_shortest_product_sequence(
         return []
 
     # --- Initialize BFS ---
-    queue = collections.deque([(initial_effects_frozen, [])])
-    visited: Set[FrozenSet[str]] = {initial_effects_frozen}
-    visited_paths: Dict[FrozenSet[str], List[str]] = {initial_effects_frozen: []}
+    # States are encoded; sequences are rebuilt from the parent links
+    start_state = encode_effects(initial_effects_set)
+    target_mask = encode_effects(target_set)
+
+    if bidirectional:
+        found = find_shortest_sequence_bidirectional(
+            start_state, target_mask, constraints, max_ingredients
+        )
+        if found is not None:
+            final_state = start_state
+            for ingredient_index in found:
+                final_state = apply_ingredient_mask(
+                    final_state, COMPILED_INGREDIENTS[ingredient_index]
+                )
+            sequence = [ALL_INGREDIENTS[i] for i in found]
+            print_shortest_solution(sequence, decode_effects(final_state))
+            return sequence
+        print(
+            f"\n{C_RED}No solution found{C_RESET} adding up to {max_ingredients} ingredients for target: {C_YELLOW}{sorted(list(target_set))}{C_RESET}"
+        )
+        return None
+
+    banned_mask = sum(
+        1 << INGREDIENT_INDEX[ingredient] for ingredient in constraints.banned_ingredients
+    )
+    visited = VisitedTable(max_depth=max_ingredients)
+    visited.insert(start_state, 0)
+    # Ingredient indices each entry can skip, see commuting_predecessors
+    skip_masks = array(INGREDIENT_SET_TYPECODE, [0])
+    queue = collections.deque([0])
+
+    def sequence_of(entry: int) -> List[str]:
+        return [ALL_INGREDIENTS[i] for i in visited.path(entry)]
 
     while queue:
-        current_effects_frozen, added_sequence = queue.popleft()
-        current_effects_set = set(current_effects_frozen)
+        entry = queue.popleft()
+        current_state = visited.states[entry]
+        current_depth = visited.depths[entry]
+        commuting_predecessors = commuting_predecessor_masks(
+            bin(current_state).count("1")
+        )
+        skip_mask = skip_masks[entry]
 
         # --- Targeted Debug Output (Dequeue) ---
         on_debug_path_prefix = False
-        if (
-            debug_specific_sequence
-            and added_sequence == debug_specific_sequence[: len(added_sequence)]
-        ):
-            on_debug_path_prefix = True
-            print(
-                f"{C_BLUE}{Style.DIM}"
-                + "-" * 10
-                + f" DEBUG: Dequeued state for sequence prefix: {added_sequence} "
-                + "-" * 10
-            )
-            print(f"  State: {sorted(list(current_effects_set))}{C_RESET}")
+        added_sequence: List[str] = []
+        if debug_specific_sequence:
+            added_sequence = sequence_of(entry)
+            if added_sequence == debug_specific_sequence[: len(added_sequence)]:
+                on_debug_path_prefix = True
+                print(
+                    f"{C_BLUE}{Style.DIM}"
+                    + "-" * 10
+                    + f" DEBUG: Dequeued state for sequence prefix: {added_sequence} "
+                    + "-" * 10
+                )
+                print(f"  State: {sorted(decode_effects(current_state))}{C_RESET}")
 
         # --- Check Depth Limit ---
-        if len(added_sequence) >= max_ingredients:
+        if current_depth >= max_ingredients:
             continue
 
         # --- Explore Neighbors ---
-        for ingredient in ALL_INGREDIENTS:
-            next_effects_set = apply_ingredient_optimized(
-                current_effects_set, ingredient
+        next_depth = current_depth + 1
+        for ingredient_index, ingredient in enumerate(ALL_INGREDIENTS):
+            if banned_mask >> ingredient_index & 1:
+                continue
+            if skip_mask >> ingredient_index & 1 or is_noop_ingredient_mask(
+                current_state, ingredient_index
+            ):
+                if on_debug_path_prefix and debug_specific_sequence[
+                    current_depth : current_depth + 1
+                ] == [ingredient]:
+                    print(
+                        f"{C_BLUE}{Style.DIM}  DEBUG: Skipped '{ingredient}' (no-op or commuting reorder of an explored path){C_RESET}"
+                    )
+                continue
+
+            next_state = apply_ingredient_mask(
+                current_state, COMPILED_INGREDIENTS[ingredient_index]
             )
-            next_effects_frozen = frozenset(next_effects_set)
-            next_sequence = added_sequence + [ingredient]
+            is_solution = next_state & target_mask == target_mask
 
             # --- Targeted Debug Output (Transition) ---
             is_next_debug_step = False
             if (
                 on_debug_path_prefix
-                and debug_specific_sequence
-                and len(next_sequence) <= len(debug_specific_sequence)
-                and next_sequence == debug_specific_sequence[: len(next_sequence)]
+                and next_depth <= len(debug_specific_sequence)
+                and debug_specific_sequence[current_depth] == ingredient
             ):
                 is_next_debug_step = True
+                previous_entry = visited.get(next_state)
                 print(
                     f"\n{C_BLUE}{Style.DIM}  DEBUG: -> Applying '{C_CYAN}{ingredient}{C_BLUE}{Style.DIM}' (Expected next step in debug sequence)"
                 )
-                print(f"     Result State: {sorted(list(next_effects_set))}")
-                print(f"     Is Solution?: {target_set.issubset(next_effects_set)}")
-                print(f"     Already Visited?: {next_effects_frozen in visited}")
-                if next_effects_frozen in visited:
-                    previous_path = visited_paths.get(
-                        next_effects_frozen, ["(Path not tracked?)"]
-                    )
+                print(f"     Result State: {sorted(decode_effects(next_state))}")
+                print(f"     Is Solution?: {is_solution}")
+                print(f"     Already Visited?: {previous_entry >= 0}")
+                if previous_entry >= 0:
                     print(
-                        f"     !!! Visited via sequence: {previous_path} !!!{C_RESET}"
+                        f"     !!! Visited via sequence: {sequence_of(previous_entry)} !!!{C_RESET}"
                     )
 
-            if next_effects_frozen not in visited:
-                visited.add(next_effects_frozen)
-                visited_paths[next_effects_frozen] = next_sequence  # Store path
-
-                if target_set.issubset(next_effects_set):
-                    # Format ingredient list with color
-                    seq_str = f"[{', '.join(f'{C_CYAN}{ing}{C_RESET}' for ing in next_sequence)}]"
+            next_entry, is_new = visited.insert(
+                next_state, next_depth, entry, ingredient_index
+            )
+            if is_new:
+                skip_masks.append(commuting_predecessors[ingredient_index])
 
+                if is_solution and constraints.allows_final_mask(next_state):
+                    next_sequence = sequence_of(next_entry)
                     if is_next_debug_step:
                         print(
                             f"{C_BLUE}{Style.DIM}     DEBUG: Solution found on this path step!{C_RESET}"
                         )
-                    print(f"\n{C_GREEN}Solution Found!{C_RESET}")
-                    print(
-                        f"  Sequence ({C_MAGENTA}{len(next_sequence)}{C_RESET} added ingredients): {seq_str}"
-                    )
-                    print(
-                        f"  Resulting Effects: {C_DIM}{sorted(list(next_effects_set))}{C_RESET}"
-                    )
+                    print_shortest_solution(next_sequence, decode_effects(next_state))
                     return next_sequence
 
-                queue.append((next_effects_frozen, next_sequence))
+                if constraints.is_dead_end_mask(next_state):
+                    continue  # Can never become an acceptable product
+                queue.append(next_entry)
 
-            elif is_next_debug_step and target_set.issubset(next_effects_set):
-                print(
-                    f"{C_BLUE}{Style.DIM}  DEBUG: State is solution BUT was already visited.{C_RESET}"
-                )
+            else:
+                if visited.depths[next_entry] == next_depth and skip_masks[next_entry]:
+                    # Another edge reaching the state at the same depth narrows what it may skip
+                    skip_masks[next_entry] &= commuting_predecessors[ingredient_index]
+                if is_next_debug_step and is_solution:
+                    print(
+                        f"{C_BLUE}{Style.DIM}  DEBUG: State is solution BUT was already visited.{C_RESET}"
+                    )
 
     # If queue becomes empty and no solution was found
     print(
@@ -681,6 +1867,186 @@ def find_shortest_product_sequence(
     return None
 
 
+def iter_shortest_product_sequences(
+    target_effects: List[str],
+    starting_effects: Optional[List[str]] = None,
+    max_ingredients: int = 8,
+    constraints: Optional[SearchConstraints] = None,
+) -> Iterator[List[str]]:
+    """
+    Lazily yields every recipe reaching the target effects, shortest first:
+    all recipes of the shortest length, then the next length, and so on up to
+    max_ingredients. Invalid effects are ignored.
+
+    Unlike find_shortest_product_sequence, states keep *all* of their parents,
+    so alternative paths to a goal are not discarded. Each edge is stored once
+    however long the recipes get: every state has one parent list and a
+    bitmask of the recipe lengths that reach it, and only the current layer
+    (the states reachable with exactly d ingredients) is held as a set. At the
+    last allowed length only goal states are kept. Layers are only built when the consumer asks for longer recipes, and recipes are
+    enumerated backwards from the goal states one at a time, following only
+    parents reachable with exactly the remaining number of ingredients.
+
+    Only minimal recipes are produced: they stop at the first state meeting the
+    target, never contain an ingredient that changes nothing, and never return
+    to a state they already passed through. Optional constraints restrict the
+    ingredients and the final product as in find_shortest_product_sequence.
+    """
+    if constraints is None:
+        constraints = SearchConstraints()
+    allowed_ingredients = [
+        (i, compiled)
+        for i, compiled in enumerate(COMPILED_INGREDIENTS)
+        if ALL_INGREDIENTS[i] not in constraints.banned_ingredients
+    ]
+
+    def is_goal(state: int) -> bool:
+        return state & target_mask == target_mask and constraints.allows_final_mask(
+            state
+        )
+
+    target_mask = encode_effects(
+        eff for eff in target_effects if eff in ALL_VALID_EFFECTS
+    )
+    start_state = encode_effects(
+        eff for eff in starting_effects or [] if eff in ALL_VALID_EFFECTS
+    )
+    if not target_mask:
+        return
+    if is_goal(start_state):
+        yield []
+        return
+
+    # Bit d of lengths[state] is set when some recipe prefix of exactly d
+    # ingredients reaches the state. parents[state] lists every edge into it,
+    # packed as parent << ingredient_bits | ingredient index.
+    ingredient_bits = len(ALL_INGREDIENTS).bit_length()
+    ingredient_mask = (1 << ingredient_bits) - 1
+    lengths: Dict[int, int] = {start_state: 1}
+    parents: Dict[int, List[int]] = {start_state: []}
+
+    def iter_paths(depth: int, state: int, suffix: List[int], on_path: Set[int]):
+        if depth == 0:
+            yield [ALL_INGREDIENTS[i] for i in reversed(suffix)]
+            return
+        for edge in parents[state]:
+            parent = edge >> ingredient_bits
+            if parent in on_path or not lengths[parent] >> (depth - 1) & 1:
+                continue
+            suffix.append(edge & ingredient_mask)
+            on_path.add(parent)
+            yield from iter_paths(depth - 1, parent, suffix, on_path)
+            on_path.discard(parent)
+            suffix.pop()
+
+    layer: Dict[int, None] = {start_state: None}  # Insertion ordered set
+    for depth in range(1, max_ingredients + 1):
+        next_layer: Dict[int, None] = {}
+        bit = 1 << depth
+        last = depth == max_ingredients
+        for state in layer:
+            if is_goal(state):
+                continue  # Recipes end at the first state meeting the target
+            # Edges out of a state are the same at every depth, so they are
+            # only recorded the first time it is expanded
+            first_expansion = not lengths[state] & ((bit >> 1) - 1)
+            for ingredient_index, compiled in allowed_ingredients:
+                if is_noop_ingredient_mask(state, ingredient_index):
+                    continue
+                next_state = apply_ingredient_mask(state, compiled)
+                if constraints.is_dead_end_mask(next_state):
+                    continue
+                if last and not is_goal(next_state):
+                    continue  # Nothing is expanded past the last layer
+                next_layer[next_state] = None
+                if next_state in lengths:
+                    lengths[next_state] |= bit
+                else:
+                    lengths[next_state] = bit
+                    parents[next_state] = []
+                if first_expansion:
+                    parents[next_state].append(state << ingredient_bits | ingredient_index)
+        if not next_layer:
+            return
+        layer = next_layer
+        for state in layer:
+            if is_goal(state):
+                yield from iter_paths(depth, state, [], {state})
+
+
+def find_alternative_product_sequences(
+    target_effects: List[str],
+    starting_effects: Optional[List[str]] = None,
+    product_name: Optional[str] = None,
+    max_ingredients: int = 8,
+    num_alternatives: int = 5,
+    exclude_effects: Optional[List[str]] = None,
+    ban_ingredients: Optional[List[str]] = None,
+    max_effects: Optional[int] = None,
+) -> List[List[str]]:
+    """
+    Prints up to num_alternatives recipes for the target effects, shortest
+    first, as they are produced by iter_shortest_product_sequences.
+
+    Returns:
+        The list of recipes found (possibly fewer than num_alternatives).
+    """
+    invalid = [eff for eff in target_effects if eff not in ALL_VALID_EFFECTS]
+    invalid += [eff for eff in starting_effects or [] if eff not in ALL_VALID_EFFECTS]
+    if invalid:
+        print(
+            f"{C_YELLOW}Warning:{C_RESET} Invalid effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+        )
+    start_set = {eff for eff in starting_effects or [] if eff in ALL_VALID_EFFECTS}
+    target_set = {eff for eff in target_effects if eff in ALL_VALID_EFFECTS}
+    start_display_name = (
+        product_name
+        if product_name
+        else ("Empty product" if not start_set else "Unnamed product")
+    )
+
+    print(
+        f"\n{Style.BRIGHT}Searching for {num_alternatives} shortest alternative sequences{C_RESET} (max {max_ingredients} added ingredients)"
+    )
+    print(f"  Starting product: {C_YELLOW}{start_display_name}{C_RESET}")
+    if start_set:
+        print(f"    {C_DIM}Contains Effects: {sorted(start_set)}{C_RESET}")
+    print(f"  Target Effects:  {C_YELLOW}{sorted(target_set)}{C_RESET}")
+    constraints = build_search_constraints(
+        exclude_effects, ban_ingredients, max_effects
+    )
+    for line in constraints.describe():
+        print(f"  {line}")
+
+    found = []
+    recipes = iter_shortest_product_sequences(
+        target_effects, starting_effects, max_ingredients, constraints
+    )
+    for sequence in itertools.islice(recipes, num_alternatives):
+        found.append(sequence)
+        state = encode_effects(start_set)
+        for ingredient in sequence:
+            state = apply_ingredient_mask(
+                state, COMPILED_INGREDIENTS[INGREDIENT_INDEX[ingredient]]
+            )
+        seq_str = f"[{', '.join(f'{C_CYAN}{ing}{C_RESET}' for ing in sequence)}]"
+        print(
+            f"\n  {len(found)}. Sequence ({C_MAGENTA}{len(sequence)}{C_RESET} added ingredients): {seq_str}"
+        )
+        print(f"     {C_DIM}Resulting Effects: {sorted(decode_effects(state))}{C_RESET}")
+        sys.stdout.flush()  # Stream results as they arrive
+
+    if not found:
+        print(
+            f"\n{C_RED}No solution found{C_RESET} adding up to {max_ingredients} ingredients for target: {C_YELLOW}{sorted(target_set)}{C_RESET}"
+        )
+    elif len(found) < num_alternatives:
+        print(
+            f"\n{C_DIM}Only {len(found)} recipes exist within {max_ingredients} ingredients.{C_RESET}"
+        )
+    return found
+
+
 def apply_ingredients_sequence_optimized(
     starting_effects: List[str], ingredients: List[str]
 ) -> List[str]:
@@ -746,6 +2112,10 @@ def find_most_expensive_products(
     base_product_name: str,
     max_ingredients: int,
     num_results: int = 10,  # How many top results to display
+    exclude_effects: Optional[List[str]] = None,
+    ban_ingredients: Optional[List[str]] = None,
+    max_effects: Optional[int] = None,
+    save_states: Optional[str] = None,
 ) -> List[Tuple[int, List[str], Set[str]]]:
     """
     Finds product sequences resulting in the highest prices using BFS.
@@ -754,6 +2124,11 @@ def find_most_expensive_products(
         base_product_name: Name of the starting product ("Weed", "Meth", "Cocaine").
         max_ingredients: The maximum number of ingredients in the sequence.
         num_results: The number of top-priced results to return.
+        exclude_effects: Effects the final product must not have.
+        ban_ingredients: Ingredients that may not be used.
+        max_effects: The maximum number of effects of the final product.
+        save_states: If provided, the explored states are saved to this path
+                     for run_repricing.
 
     Returns:
         A list of tuples, sorted by price descending:
@@ -773,59 +2148,93 @@ def find_most_expensive_products(
         f"  Base Product:    {C_YELLOW}{base_product_name}{C_RESET} (${BASE_PRICES[base_product_name]})"
     )
     print(f"  Max Ingredients: {C_MAGENTA}{max_ingredients}{C_RESET}")
+    constraints = build_search_constraints(
+        exclude_effects, ban_ingredients, max_effects
+    )
+    for line in constraints.describe():
+        print(f"  {line}")
 
     # --- Initialize BFS ---
-    initial_effects_frozen = frozenset()
-    queue = collections.deque([(initial_effects_frozen, [])])
-    # Visited stores frozensets of *states* to avoid redundant exploration
-    # We still process sequences leading to already visited states if the sequence is new/shorter
-    visited_states: Set[FrozenSet[str]] = {initial_effects_frozen}
-
-    # Store results: (price, sequence, effects_set)
-    # Using a list and then sorting/heapq is easier than managing a complex sorted structure during BFS
+    # States are encoded; sequences are only rebuilt for the top results
+    banned_mask = sum(
+        1 << INGREDIENT_INDEX[ingredient] for ingredient in constraints.banned_ingredients
+    )
+    visited = VisitedTable(max_depth=max_ingredients)
+    visited.insert(0, 0)
+    # Ingredient indices each entry can skip, see commuting_predecessors
+    skip_masks = array(INGREDIENT_SET_TYPECODE, [0])
+    queue = collections.deque([0])
+
+    # Store results: (price, entry), in BFS order
+    # Using a list and then heapq is easier than managing a complex sorted structure during BFS
     all_results = []
 
     processed_count = 0
     while queue:
-        current_effects_frozen, current_sequence = queue.popleft()
-        current_effects_set = set(current_effects_frozen)
+        entry = queue.popleft()
+        current_state = visited.states[entry]
+        current_depth = visited.depths[entry]
+        commuting_predecessors = commuting_predecessor_masks(
+            bin(current_state).count("1")
+        )
+        skip_mask = skip_masks[entry]
         processed_count += 1
 
-        # --- Calculate and store price for the *current* state/sequence ---
+        # --- Calculate and store price for the *current* state ---
         # We calculate price for every state reached within the limit
-        current_price = calculate_product_price(base_product_name, current_effects_set)
-        if (
-            current_price is not None
-        ):  # Should always be not None if base product is valid
-            all_results.append((current_price, current_sequence, current_effects_set))
+        if constraints.allows_final_mask(current_state):
+            all_results.append(
+                (calculate_mask_price(base_product_name, current_state), entry)
+            )
 
         # --- Check Depth Limit ---
-        if len(current_sequence) >= max_ingredients:
+        if current_depth >= max_ingredients:
             continue  # Stop exploring further down this path
 
         # --- Explore Neighbors ---
-        for ingredient in ALL_INGREDIENTS:
-            # Calculate next state only once per ingredient transition
-            next_effects_set = apply_ingredient_optimized(
-                current_effects_set, ingredient
+        next_depth = current_depth + 1
+        for ingredient_index in range(len(ALL_INGREDIENTS)):
+            if banned_mask >> ingredient_index & 1:
+                continue
+            # No-op edges and commuting reorders cannot reach a new state
+            if skip_mask >> ingredient_index & 1 or is_noop_ingredient_mask(
+                current_state, ingredient_index
+            ):
+                continue
+
+            next_state = apply_ingredient_mask(
+                current_state, COMPILED_INGREDIENTS[ingredient_index]
             )
-            next_effects_frozen = frozenset(next_effects_set)
 
             # We only add to the queue if the *state* hasn't been visited
             # by *any* path yet, to avoid cycles and redundant BFS branches.
-            # However, we calculate the price for *every* path terminus above.
-            if next_effects_frozen not in visited_states:
-                visited_states.add(next_effects_frozen)
-                next_sequence = current_sequence + [ingredient]
-                queue.append((next_effects_frozen, next_sequence))
+            next_entry, is_new = visited.insert(
+                next_state, next_depth, entry, ingredient_index
+            )
+            if is_new:
+                skip_masks.append(commuting_predecessors[ingredient_index])
+                if constraints.is_dead_end_mask(next_state):
+                    continue  # Neither a result nor on the way to one
+                queue.append(next_entry)
+            elif visited.depths[next_entry] == next_depth and skip_masks[next_entry]:
+                skip_masks[next_entry] &= commuting_predecessors[ingredient_index]
 
     print(f"{C_DIM}Processed {processed_count} states/sequences.{C_RESET}")
+    if save_states:
+        ExploredStates.from_table(visited, max_ingredients, constraints).save(save_states)
+        print(f"{C_DIM}Saved {len(visited)} explored states to {save_states}.{C_RESET}")
 
     # --- Find Top Results ---
     # Use heapq.nlargest for efficiency, especially if all_results is huge
     # Sort key is the price (first element of the tuple)
-    top_results = nlargest(num_results, all_results, key=lambda item: item[0])
-
+    top_results = [
+        (
+            price,
+            [ALL_INGREDIENTS[i] for i in visited.path(entry)],
+            decode_effects(visited.states[entry]),
+        )
+        for price, entry in nlargest(num_results, all_results, key=lambda item: item[0])
+    ]
     # --- Print Top Results ---
     print(f"\n{Style.BRIGHT}Top {len(top_results)} Results:{C_RESET}")
     if not top_results:
@@ -844,44 +2253,2859 @@ def find_most_expensive_products(
     return top_results
 
 
-def try_all_ingredients(sequence):
+def iter_cheapest_states(start_state: int, max_ingredients: int):
     """
-    Test all ingredients in the system to see if they produce the expected base effects.
-    This is a sanity check to ensure that the base effects are correctly defined.
+    Dijkstra over the encoded state graph, weighted by INGREDIENT_COSTS.
+
+    Yields (state, cost, sequence) once per reachable state, in order of
+    increasing cost, where cost is the cheapest way to reach the state with at
+    most max_ingredients ingredients. Because of the ingredient limit a state
+    may be settled again later with fewer ingredients (and a higher cost) so
+    its successors stay reachable, but it is only yielded the first time.
     """
-    find_shortest_product_sequence(
-        sequence, max_ingredients=8, starting_effects=[], product_name="Meth"
-    )
+    costs = [INGREDIENT_COSTS[ingredient] for ingredient in ALL_INGREDIENTS]
+    # Settled labels: (state, parent label index, ingredient index)
+    labels: List[Tuple[int, int, int]] = []
+    settled_depth: Dict[int, int] = {}  # state -> fewest ingredients settled with
+    # Heap entries: (cost, depth, tie breaker, state, parent label, ingredient)
+    heap = [(0, 0, 0, start_state, -1, -1)]
+    pushes = 0
+
+    def sequence_of(label_index: int) -> List[str]:
+        sequence = []
+        while label_index >= 0:
+            _, parent, ingredient_index = labels[label_index]
+            if ingredient_index >= 0:
+                sequence.append(ALL_INGREDIENTS[ingredient_index])
+            label_index = parent
+        sequence.reverse()
+        return sequence
+
+    while heap:
+        cost, depth, _, state, parent, ingredient_index = heappop(heap)
+        previous_depth = settled_depth.get(state)
+        if previous_depth is not None and previous_depth <= depth:
+            continue  # Dominated: cheaper (or equal) with no more ingredients
+        settled_depth[state] = depth
+        labels.append((state, parent, ingredient_index))
+        label_index = len(labels) - 1
+        if previous_depth is None:
+            yield state, cost, sequence_of(label_index)
+
+        if depth >= max_ingredients:
+            continue
+        for next_index, compiled in enumerate(COMPILED_INGREDIENTS):
+            if is_noop_ingredient_mask(state, next_index):
+                continue
+            next_state = apply_ingredient_mask(state, compiled)
+            next_settled = settled_depth.get(next_state)
+            if next_settled is not None and next_settled <= depth + 1:
+                continue
+            pushes += 1
+            heappush(
+                heap,
+                (
+                    cost + costs[next_index],
+                    depth + 1,
+                    pushes,
+                    next_state,
+                    label_index,
+                    next_index,
+                ),
+            )
 
-    find_shortest_product_sequence(
-        sequence,
-        max_ingredients=8,
-        starting_effects=["Calming"],
-        product_name="Og Kush",
-    )
 
-    find_shortest_product_sequence(
-        sequence,
-        max_ingredients=8,
-        starting_effects=["Refreshing"],
-        product_name="Sour Diesel",
-    )
+def find_cheapest_product_sequence(
+    target_effects: List[str],
+    starting_effects: Optional[List[str]] = None,
+    product_name: Optional[str] = None,
+    max_ingredients: int = 8,
+) -> Optional[Tuple[int, List[str]]]:
+    """
+    Finds the cheapest sequence of additional ingredients (by INGREDIENT_COSTS,
+    up to max_ingredients) that results in a state including all target_effects.
+    Uses Dijkstra's algorithm with a binary heap on the encoded states.
 
-    find_shortest_product_sequence(
-        sequence,
-        max_ingredients=8,
-        starting_effects=["Energizing"],
-        product_name="Green Crack",
+    Returns:
+        (total cost, sequence) for the cheapest solution, or None if there is
+        no solution within the limit.
+    """
+    invalid = [eff for eff in target_effects if eff not in ALL_VALID_EFFECTS]
+    invalid += [eff for eff in starting_effects or [] if eff not in ALL_VALID_EFFECTS]
+    if invalid:
+        print(
+            f"{C_YELLOW}Warning:{C_RESET} Invalid effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+        )
+    target_mask = encode_effects(
+        eff for eff in target_effects if eff in ALL_VALID_EFFECTS
     )
-
-    find_shortest_product_sequence(
-        sequence,
-        max_ingredients=8,
-        starting_effects=["Sedating"],
-        product_name="Granddaddy Purple",
+    start_state = encode_effects(
+        eff for eff in starting_effects or [] if eff in ALL_VALID_EFFECTS
     )
+    if not target_mask:
+        print(
+            f"{C_YELLOW}Target effects list is empty or contained only invalid effects. Cannot search.{C_RESET}"
+        )
+        return None
+
+    start_display_name = (
+        product_name
+        if product_name
+        else ("Empty product" if not start_state else "Unnamed product")
+    )
+    print(
+        f"\n{Style.BRIGHT}Searching for cheapest sequence{C_RESET} (max {max_ingredients} added ingredients)"
+    )
+    print(f"  Starting product: {C_YELLOW}{start_display_name}{C_RESET}")
+    if start_state:
+        print(
+            f"    {C_DIM}Contains Effects: {sorted(decode_effects(start_state))}{C_RESET}"
+        )
+    print(f"  Target Effects:  {C_YELLOW}{sorted(decode_effects(target_mask))}{C_RESET}")
+
+    for state, cost, sequence in iter_cheapest_states(start_state, max_ingredients):
+        if state & target_mask == target_mask:
+            seq_str = f"[{', '.join(f'{C_CYAN}{ing}{C_RESET}' for ing in sequence)}]"
+            print(f"\n{C_GREEN}Solution Found!{C_RESET}")
+            print(f"  Ingredient Cost: {C_GREEN}${cost}{C_RESET}")
+            print(
+                f"  Sequence ({C_MAGENTA}{len(sequence)}{C_RESET} added ingredients): {seq_str}"
+            )
+            print(
+                f"  Resulting Effects: {C_DIM}{sorted(decode_effects(state))}{C_RESET}"
+            )
+            return cost, sequence
+
+    print(
+        f"\n{C_RED}No solution found{C_RESET} adding up to {max_ingredients} ingredients for target: {C_YELLOW}{sorted(decode_effects(target_mask))}{C_RESET}"
+    )
+    return None
+
+
+def find_most_profitable_products(
+    base_product_name: str,
+    max_ingredients: int,
+    num_results: int = 10,
+    target_effects: Optional[List[str]] = None,
+    starting_effects: Optional[List[str]] = None,
+    product_name: Optional[str] = None,
+) -> List[Tuple[int, int, int, List[str], Set[str]]]:
+    """
+    Finds the sequences with the highest margin, i.e. calculate_product_price
+    minus the cost of the added ingredients. Every reachable state is priced
+    once with the cheapest way to reach it (see iter_cheapest_states).
+
+    Args:
+        base_product_name: Name of the starting product ("Weed", "Meth", "Cocaine").
+        max_ingredients: The maximum number of ingredients in the sequence.
+        num_results: The number of top results to return.
+        target_effects: Optional effects the final product must include.
+        starting_effects: Optional effects the product has before any
+            ingredient is added (default: none).
+        product_name: Optional name for the starting product.
+
+    Returns:
+        A list of tuples, sorted by profit descending:
+        [(profit, price, ingredient_cost, sequence_list, final_effects_set), ...]
+    """
+    if base_product_name not in BASE_PRICES:
+        print(
+            f"{C_RED}Error: Unknown base product '{base_product_name}'. Valid options: {list(BASE_PRICES.keys())}{C_RESET}"
+        )
+        return []
+    invalid = [eff for eff in target_effects or [] if eff not in ALL_VALID_EFFECTS]
+    invalid += [eff for eff in starting_effects or [] if eff not in ALL_VALID_EFFECTS]
+    if invalid:
+        print(
+            f"{C_YELLOW}Warning:{C_RESET} Invalid effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+        )
+    target_mask = encode_effects(
+        eff for eff in target_effects or [] if eff in ALL_VALID_EFFECTS
+    )
+    start_state = encode_effects(
+        eff for eff in starting_effects or [] if eff in ALL_VALID_EFFECTS
+    )
+    start_display_name = (
+        product_name
+        if product_name
+        else ("Empty product" if not start_state else "Unnamed product")
+    )
+
+    print(
+        f"\n{Style.BRIGHT}Searching for Top {num_results} Most Profitable products{C_RESET}"
+    )
+    print(
+        f"  Base Product:    {C_YELLOW}{base_product_name}{C_RESET} (${BASE_PRICES[base_product_name]})"
+    )
+    print(f"  Starting product: {C_YELLOW}{start_display_name}{C_RESET}")
+    if start_state:
+        print(
+            f"    {C_DIM}Contains Effects: {sorted(decode_effects(start_state))}{C_RESET}"
+        )
+    print(f"  Max Ingredients: {C_MAGENTA}{max_ingredients}{C_RESET}")
+    if target_mask:
+        print(
+            f"  Target Effects:  {C_YELLOW}{sorted(decode_effects(target_mask))}{C_RESET}"
+        )
+
+    candidates = []
+    processed_count = 0
+    for state, cost, sequence in iter_cheapest_states(start_state, max_ingredients):
+        processed_count += 1
+        if state & target_mask != target_mask:
+            continue
+        price = calculate_mask_price(base_product_name, state)
+        candidates.append((price - cost, price, cost, sequence, state))
+
+    print(f"{C_DIM}Processed {processed_count} states.{C_RESET}")
+    top_results = [
+        (profit, price, cost, sequence, decode_effects(state))
+        for profit, price, cost, sequence, state in nlargest(
+            num_results, candidates, key=lambda item: item[0]
+        )
+    ]
+
+    print(f"\n{Style.BRIGHT}Top {len(top_results)} Results:{C_RESET}")
+    if not top_results:
+        print(f"  {C_YELLOW}No results found (check max_ingredients).{C_RESET}")
+    for i, (profit, price, cost, sequence, effects) in enumerate(top_results):
+        seq_str = (
+            f"[{', '.join(f'{C_CYAN}{ing}{C_RESET}' for ing in sequence)}]"
+            if sequence
+            else "[](Base)"
+        )
+        print(
+            f"  {i+1}. Profit: {C_GREEN}${profit}{C_RESET} (price ${price} - ingredients ${cost})"
+        )
+        print(f"     Sequence ({len(sequence)} ingredients): {seq_str}")
+        print(f"     {C_DIM}Effects: {sorted(list(effects))}{C_RESET}")
+
+    return top_results
+
+
+# --- Recipe Counting ---
+# Counts come from a forward DP over (state, depth) multiplicities: layer d maps
+# each state to the number of length-d ingredient sequences ending in it, and
+# every state passes its count on to its 16 successors. Sequences are never
+# materialized, so the cost grows with the number of distinct states rather
+# than with 16^depth. No-op edges keep their count on the same state, and no
+# edges are pruned, since every ordering is a distinct sequence here.
+
+
+class DepthCount(NamedTuple):
+    depth: int
+    sequences: int  # Sequences of exactly this length
+    matching_sequences: int  # ... whose product has all target effects
+    states: int  # Distinct final states of those sequences
+    matching_states: int
+    new_states: int  # States not reachable with fewer ingredients
+
+
+def count_recipes(
+    target_effects: Optional[List[str]] = None,
+    starting_effects: Optional[List[str]] = None,
+    max_ingredients: int = 6,
+) -> List[DepthCount]:
+    """
+    Counts ingredient sequences and final states per sequence length.
+
+    Args:
+        target_effects: Effects a product must have to count as matching
+                        (default: every product matches).
+        starting_effects: An optional list of effects already present.
+        max_ingredients: The longest sequence length to count.
+
+    Returns:
+        One DepthCount per length, from 0 to max_ingredients.
+    """
+    target_mask = encode_effects(
+        eff for eff in target_effects or [] if eff in ALL_VALID_EFFECTS
+    )
+    start_state = encode_effects(
+        eff for eff in starting_effects or [] if eff in ALL_VALID_EFFECTS
+    )
+    num_ingredients = len(COMPILED_INGREDIENTS)
+
+    layer: Dict[int, int] = {start_state: 1}
+    seen = {start_state}
+    counts = []
+    for depth in range(max_ingredients + 1):
+        if depth > 0:
+            next_layer: Dict[int, int] = collections.defaultdict(int)
+            for state, multiplicity in layer.items():
+                noop_mask = 0
+                for i in range(num_ingredients):
+                    if is_noop_ingredient_mask(state, i):
+                        noop_mask |= 1 << i
+                        continue
+                    next_layer[apply_ingredient_mask(state, COMPILED_INGREDIENTS[i])] += (
+                        multiplicity
+                    )
+                if noop_mask:
+                    next_layer[state] += multiplicity * bin(noop_mask).count("1")
+            layer = next_layer
+            new_states = len(layer.keys() - seen)
+            seen.update(layer)
+        else:
+            new_states = 1
+
+        matching = [
+            multiplicity
+            for state, multiplicity in layer.items()
+            if state & target_mask == target_mask
+        ]
+        counts.append(
+            DepthCount(
+                depth=depth,
+                sequences=sum(layer.values()),
+                matching_sequences=sum(matching),
+                states=len(layer),
+                matching_states=len(matching),
+                new_states=new_states,
+            )
+        )
+    return counts
+
+
+def print_recipe_counts(
+    target_effects: Optional[List[str]] = None,
+    starting_effects: Optional[List[str]] = None,
+    max_ingredients: int = 6,
+) -> List[DepthCount]:
+    """Runs count_recipes and prints the counts as a table."""
+    for label, effects in (("target", target_effects), ("starting", starting_effects)):
+        invalid = [eff for eff in effects or [] if eff not in ALL_VALID_EFFECTS]
+        if invalid:
+            print(
+                f"{C_YELLOW}Warning:{C_RESET} Invalid {label} effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+            )
+    start_set = {eff for eff in starting_effects or [] if eff in ALL_VALID_EFFECTS}
+    target_set = {eff for eff in target_effects or [] if eff in ALL_VALID_EFFECTS}
+    if target_effects and not target_set:
+        print(
+            f"{C_RED}Error: Target effects contained only invalid effects. Cannot count.{C_RESET}"
+        )
+        return []
+
+    print(
+        f"\n{Style.BRIGHT}Counting recipes{C_RESET} (up to {max_ingredients} ingredients)"
+    )
+    if start_set:
+        print(f"  Starting Effects: {C_DIM}{sorted(start_set)}{C_RESET}")
+    if target_set:
+        print(f"  Target Effects:  {C_YELLOW}{sorted(target_set)}{C_RESET}")
+
+    counts = count_recipes(sorted(target_set), sorted(start_set), max_ingredients)
+    print(
+        f"\n  {'Length':>6} {'Sequences':>14} {'Matching':>14} {'States':>10} {'Matching':>10} {'New':>10}"
+    )
+    for row in counts:
+        print(
+            f"  {row.depth:>6} {row.sequences:>14,} {C_GREEN}{row.matching_sequences:>14,}{C_RESET} "
+            f"{row.states:>10,} {C_GREEN}{row.matching_states:>10,}{C_RESET} {row.new_states:>10,}"
+        )
+    total = sum(row.matching_sequences for row in counts)
+    print(
+        f"\n  {Style.BRIGHT}{total:,}{C_RESET} sequences of at most {max_ingredients} ingredients produce the target effects."
+    )
+    return counts
+
+
+# --- Purchasable Strains ---
+# Effects each strain already has when bought from a dealer
+STRAIN_STARTING_EFFECTS: Dict[str, List[str]] = {
+    "Meth": [],
+    "OG Kush": ["Calming"],
+    "Sour Diesel": ["Refreshing"],
+    "Green Crack": ["Energizing"],
+    "Granddaddy Purple": ["Sedating"],
+}
+
+
+def find_shortest_sequences_for_strains(
+    target_effects: List[str],
+    strains: Optional[Dict[str, List[str]]] = None,
+    max_ingredients: int = 8,
+    transition_cache: Optional[TransitionCache] = None,
+) -> Dict[str, Optional[List[str]]]:
+    """
+    Finds the shortest sequence for the target effects from several starting
+    strains in a single multi-source Breadth-First Search.
+
+    All strains are searched level by level together. Each state records which
+    strains have already reached it, so a state shared by several strains is
+    expanded once per level, and all transitions go through one TransitionCache.
+
+    Args:
+        target_effects: A list of effect names that must be present.
+        strains: Strain name -> starting effects (default: STRAIN_STARTING_EFFECTS).
+        max_ingredients: The maximum number of *additional* ingredients allowed.
+        transition_cache: An optional cache to share with other searches.
+
+    Returns:
+        Strain name -> shortest list of added ingredients, or None when no
+        solution exists within the limit.
+    """
+    if strains is None:
+        strains = STRAIN_STARTING_EFFECTS
+    if transition_cache is None:
+        transition_cache = TransitionCache()
+
+    # --- Input Validation ---
+    invalid_targets = [eff for eff in target_effects if eff not in ALL_VALID_EFFECTS]
+    if invalid_targets:
+        print(
+            f"{C_YELLOW}Warning:{C_RESET} Invalid target effects provided and ignored: {C_RED}{invalid_targets}{C_RESET}"
+        )
+    target_mask = encode_effects(
+        eff for eff in target_effects if eff in ALL_VALID_EFFECTS
+    )
+    strain_names = list(strains.keys())
+    solutions: Dict[str, Optional[List[str]]] = {name: None for name in strain_names}
+    if not target_mask or not strain_names:
+        print(
+            f"{C_YELLOW}Target effects list is empty or contained only invalid effects. Cannot search.{C_RESET}"
+        )
+        return solutions
+
+    print(
+        f"\n{Style.BRIGHT}Searching for shortest sequence from {len(strain_names)} strains{C_RESET} (max {max_ingredients} added ingredients)"
+    )
+    print(f"  Target Effects:  {C_YELLOW}{sorted(decode_effects(target_mask))}{C_RESET}")
+
+    # --- Initialize Multi-Source BFS ---
+    all_strains = (1 << len(strain_names)) - 1
+    solved = 0
+    reached: Dict[int, int] = {}  # state -> bitmask of strains that reached it
+    # Per strain: state -> (previous state, ingredient index)
+    parents: List[Dict[int, Optional[Tuple[int, int]]]] = []
+    frontier: Dict[int, int] = {}
+    for i, name in enumerate(strain_names):
+        start = encode_effects(
+            eff for eff in strains[name] if eff in ALL_VALID_EFFECTS
+        )
+        parents.append({start: None})
+        reached[start] = reached.get(start, 0) | (1 << i)
+        frontier[start] = frontier.get(start, 0) | (1 << i)
+
+    def reconstruct(strain_index: int, state: int) -> List[str]:
+        sequence = []
+        step = parents[strain_index][state]
+        while step is not None:
+            state, ingredient_index = step
+            sequence.append(ALL_INGREDIENTS[ingredient_index])
+            step = parents[strain_index][state]
+        sequence.reverse()
+        return sequence
+
+    def record_solutions(level: Dict[int, int]) -> int:
+        newly_solved = 0
+        for state, strain_mask in level.items():
+            if state & target_mask != target_mask:
+                continue
+            for i in range(len(strain_names)):
+                bit = 1 << i
+                if strain_mask & bit and not (solved | newly_solved) & bit:
+                    solutions[strain_names[i]] = reconstruct(i, state)
+                    newly_solved |= bit
+        return newly_solved
+
+    solved |= record_solutions(frontier)
+    depth = 0
+    skip_masks: Dict[int, int] = {}  # Skip masks of the current frontier
+    while frontier and depth < max_ingredients and solved != all_strains:
+        next_frontier: Dict[int, int] = {}
+        next_skip_masks: Dict[int, int] = {}
+        for state, strain_mask in frontier.items():
+            active = strain_mask & ~solved  # Solved strains stop expanding
+            if not active:
+                continue
+            skip_mask = skip_masks.get(state, 0)
+            commuting_predecessors = commuting_predecessor_masks(
+                bin(state).count("1")
+            )
+            for ingredient_index in range(len(ALL_INGREDIENTS)):
+                if skip_mask >> ingredient_index & 1 or is_noop_ingredient_mask(
+                    state, ingredient_index
+                ):
+                    continue
+                next_state = transition_cache.apply(state, ingredient_index)
+                if next_state in next_skip_masks:
+                    # Reached again on this level: narrow its skip mask
+                    next_skip_masks[next_state] &= commuting_predecessors[
+                        ingredient_index
+                    ]
+                new_strains = active & ~reached.get(next_state, 0)
+                if not new_strains:
+                    continue
+                if next_state not in next_frontier:
+                    next_skip_masks[next_state] = commuting_predecessors[
+                        ingredient_index
+                    ]
+                reached[next_state] = reached.get(next_state, 0) | new_strains
+                next_frontier[next_state] = (
+                    next_frontier.get(next_state, 0) | new_strains
+                )
+                for i in range(len(strain_names)):
+                    if new_strains >> i & 1:
+                        parents[i][next_state] = (state, ingredient_index)
+        depth += 1
+        solved |= record_solutions(next_frontier)
+        frontier = next_frontier
+        skip_masks = next_skip_masks
+
+    # --- Report ---
+    print(f"\n{Style.BRIGHT}Results per strain:{C_RESET}")
+    for name in strain_names:
+        sequence = solutions[name]
+        if sequence is None:
+            print(f"  {C_YELLOW}{name}{C_RESET}: {C_RED}No solution found{C_RESET}")
+        else:
+            seq_str = f"[{', '.join(f'{C_CYAN}{ing}{C_RESET}' for ing in sequence)}]"
+            print(
+                f"  {C_YELLOW}{name}{C_RESET} ({C_MAGENTA}{len(sequence)}{C_RESET} added ingredients): {seq_str}"
+            )
+
+    found = [(len(seq), name) for name, seq in solutions.items() if seq is not None]
+    if found:
+        best_length, best_name = min(found)
+        print(
+            f"\n{C_GREEN}Fastest strain:{C_RESET} {C_YELLOW}{best_name}{C_RESET} ({C_MAGENTA}{best_length}{C_RESET} added ingredients)"
+        )
+    else:
+        print(
+            f"\n{C_RED}No solution found{C_RESET} from any strain adding up to {max_ingredients} ingredients."
+        )
+    print(
+        f"{C_DIM}Explored {len(reached)} states, {len(transition_cache)} expanded ({transition_cache.hits} transition cache hits).{C_RESET}"
+    )
+    return solutions
+
+
+def try_all_ingredients(sequence):
+    """
+    Finds the shortest sequence for the given effects from every purchasable
+    strain, reporting which strain reaches the target fastest.
+    """
+    return find_shortest_sequences_for_strains(sequence, max_ingredients=8)
+
+
+# --- Value Table ---
+# Backward dynamic programming over every state reachable from the purchasable
+# strains within `depth` ingredients. V_k(s) is the best multiplier sum (in
+# hundredths) reachable from s with at most k more ingredients:
+#   V_0(s) = multipliers(s)
+#   V_k(s) = max(V_0(s), max over ingredients i of V_{k-1}(apply(s, i)))
+# Prices grow monotonically with the multiplier sum, so one table answers every
+# base product. V_k is exact for states first reached within depth - k
+# ingredients; states are stored in BFS order, so those are a prefix of the
+# arrays and each V_k array only covers that prefix.
+
+VALUE_TABLE_PATH = "value_table.bin"
+VALUE_TABLE_MAGIC = b"S1VT"
+
+
+class ValueTable:
+    """
+    Best achievable price and best next ingredient for every reachable state
+    and remaining ingredient budget, stored as flat arrays.
+    """
+
+    def __init__(
+        self,
+        depth: int,
+        states: array,
+        layer_ends: List[int],
+        values: List[array],
+        best: List[array],
+        fingerprint: str,
+    ):
+        self.depth = depth
+        self.states = states  # 'Q', in BFS order
+        self.layer_ends = layer_ends  # layer_ends[d] = states first reached within d
+        self.values = values  # values[k]: 'H', V_k for the first layer_ends[depth - k] states
+        self.best = best  # best[k]: 'b', ingredient index or -1 to stop (best[0] unused)
+        self.fingerprint = fingerprint
+        self.index = {state: i for i, state in enumerate(states)}
+        self._fallback: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+    @classmethod
+    def build(cls, depth: int = 7, roots: Optional[List[int]] = None) -> "ValueTable":
+        """
+        Builds the table for every state within depth ingredients of the roots.
+
+        Args:
+            depth: How many ingredients from the roots the table covers.
+            roots: Encoded starting states (default: every purchasable strain).
+        """
+        if roots is None:
+            roots = [encode_effects(e) for e in STRAIN_STARTING_EFFECTS.values()]
+        num_ingredients = len(COMPILED_INGREDIENTS)
+
+        states = array("Q", dict.fromkeys(roots))
+        index = {state: i for i, state in enumerate(states)}
+        layer_ends = [len(states)]
+        successors = array("l")  # successors[i * num_ingredients + j]
+        for _ in range(depth):
+            for i in range(layer_ends[-2] if len(layer_ends) > 1 else 0, layer_ends[-1]):
+                state = states[i]
+                for compiled in COMPILED_INGREDIENTS:
+                    next_state = apply_ingredient_mask(state, compiled)
+                    next_index = index.get(next_state)
+                    if next_index is None:
+                        next_index = index[next_state] = len(states)
+                        states.append(next_state)
+                    successors.append(next_index)
+            layer_ends.append(len(states))
+
+        values = [array("H", map(mask_multiplier_hundredths, states))]
+        best = [array("b")]
+        for k in range(1, depth + 1):
+            previous = values[-1]
+            count = layer_ends[depth - k]
+            current = array("H", previous[:count])
+            choices = array("b", [-1]) * count
+            for i in range(count):
+                value = current[i]
+                offset = i * num_ingredients
+                for j in range(num_ingredients):
+                    next_value = previous[successors[offset + j]]
+                    if next_value > value:
+                        value = next_value
+                        choices[i] = j
+                current[i] = value
+            values.append(current)
+            best.append(choices)
+        return cls(depth, states, layer_ends, values, best, rules_fingerprint())
+
+    def save(self, path: str = VALUE_TABLE_PATH):
+        """Saves the table as a JSON header followed by the raw arrays."""
+        header = json.dumps(
+            {
+                "version": 1,
+                "fingerprint": self.fingerprint,
+                "depth": self.depth,
+                "layer_ends": self.layer_ends,
+                "byteorder": sys.byteorder,
+            }
+        ).encode()
+        with open(path, "wb") as f:
+            f.write(VALUE_TABLE_MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            self.states.tofile(f)
+            for values in self.values:
+                values.tofile(f)
+            for choices in self.best[1:]:
+                choices.tofile(f)
+
+    @classmethod
+    def load(cls, path: str = VALUE_TABLE_PATH) -> "ValueTable":
+        """
+        Loads a saved table.
+
+        Raises:
+            ValueError: If the file is not a value table or was built for
+                        different rules.
+        """
+        with open(path, "rb") as f:
+            if f.read(4) != VALUE_TABLE_MAGIC:
+                raise ValueError(f"{path} is not a value table.")
+            (header_length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+            if header["fingerprint"] != rules_fingerprint():
+                raise ValueError(
+                    f"{path} was built for different ingredient rules; rebuild it."
+                )
+            depth = header["depth"]
+            layer_ends = header["layer_ends"]
+
+            def read(typecode: str, count: int) -> array:
+                data = array(typecode)
+                data.fromfile(f, count)
+                if header["byteorder"] != sys.byteorder:
+                    data.byteswap()
+                return data
+
+            states = read("Q", layer_ends[depth])
+            values = [read("H", layer_ends[depth - k]) for k in range(depth + 1)]
+            best = [array("b")] + [
+                read("b", layer_ends[depth - k]) for k in range(1, depth + 1)
+            ]
+        return cls(depth, states, layer_ends, values, best, header["fingerprint"])
+
+    def covered_budget(self, state: int) -> int:
+        """The largest budget answered straight from the table (-1 if unknown)."""
+        i = self.index.get(state)
+        if i is None:
+            return -1
+        for d, end in enumerate(self.layer_ends):
+            if i < end:
+                return self.depth - d
+        return -1
+
+    def best_move(self, state: int, remaining: int) -> Tuple[int, int]:
+        """
+        Returns (best multiplier sum in hundredths, best next ingredient index
+        or -1 to stop). States or budgets beyond the table are solved by a
+        memoized search that falls back on the table wherever it can.
+        """
+        i = self.index.get(state)
+        if i is not None and remaining <= self.depth and i < len(self.values[remaining]):
+            choice = self.best[remaining][i] if remaining else -1
+            return self.values[remaining][i], choice
+
+        key = (state, remaining)
+        cached = self._fallback.get(key)
+        if cached is not None:
+            return cached
+        value, choice = mask_multiplier_hundredths(state), -1
+        if remaining > 0:
+            for j, compiled in enumerate(COMPILED_INGREDIENTS):
+                next_value, _ = self.best_move(
+                    apply_ingredient_mask(state, compiled), remaining - 1
+                )
+                if next_value > value:
+                    value, choice = next_value, j
+        self._fallback[key] = (value, choice)
+        return value, choice
+
+    def best_sequence(self, state: int, remaining: int) -> Tuple[List[str], int]:
+        """Follows the best moves; returns the added ingredients and final state."""
+        sequence = []
+        while remaining > 0:
+            _, choice = self.best_move(state, remaining)
+            if choice < 0:
+                break
+            sequence.append(ALL_INGREDIENTS[choice])
+            state = apply_ingredient_mask(state, COMPILED_INGREDIENTS[choice])
+            remaining -= 1
+        return sequence, state
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+
+def load_or_build_value_table(
+    path: str = VALUE_TABLE_PATH, depth: Optional[int] = None, rebuild: bool = False
+) -> ValueTable:
+    """
+    Loads the saved table, building and saving a new one when it is missing,
+    stale, built to a different depth than requested, or rebuild is set.
+    """
+    if not rebuild and os.path.exists(path):
+        try:
+            table = ValueTable.load(path)
+        except ValueError as e:
+            print(f"{C_YELLOW}Warning:{C_RESET} {e}")
+        else:
+            if depth is None or table.depth == depth:
+                return table
+    depth = 7 if depth is None else depth
+    print(f"{C_DIM}Building value table (depth {depth})...{C_RESET}")
+    table = ValueTable.build(depth)
+    table.save(path)
+    print(f"{C_DIM}Saved {len(table)} states to {path}.{C_RESET}")
+    return table
+
+
+def suggest_next_ingredient(
+    base_product_name: str,
+    current_effects: List[str],
+    remaining: Optional[int] = None,
+    table: Optional[ValueTable] = None,
+) -> Optional[str]:
+    """
+    Suggests the next ingredient that leads to the highest price.
+
+    Args:
+        base_product_name: Name of the base product, used for the prices shown.
+        current_effects: The effects of the partially mixed product.
+        remaining: How many more ingredients may be added (default: as many as
+                   the table covers for this state, at least 1).
+        table: The value table to use (default: loaded or built at VALUE_TABLE_PATH).
+
+    Returns:
+        The suggested ingredient, or None if stopping is best.
+    """
+    invalid = [eff for eff in current_effects if eff not in ALL_VALID_EFFECTS]
+    if invalid:
+        print(
+            f"{C_YELLOW}Warning:{C_RESET} Invalid effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+        )
+    state = encode_effects(eff for eff in current_effects if eff in ALL_VALID_EFFECTS)
+    if table is None:
+        table = load_or_build_value_table()
+    if remaining is None:
+        remaining = max(1, table.covered_budget(state))
+
+    print(
+        f"\n{Style.BRIGHT}Suggesting next ingredient{C_RESET} ({remaining} more allowed)"
+    )
+    print(f"  Base Product: {C_YELLOW}{base_product_name}{C_RESET}")
+    print(f"  Current Effects: {C_DIM}{sorted(decode_effects(state))}{C_RESET}")
+    print(
+        f"  Current Price: {C_GREEN}${calculate_mask_price(base_product_name, state)}{C_RESET}"
+    )
+
+    if table.covered_budget(state) < remaining:
+        print(
+            f"  {C_DIM}Beyond the table (depth {table.depth}), solving the rest on the fly...{C_RESET}"
+        )
+    value, choice = table.best_move(state, remaining)
+    sequence, final_state = table.best_sequence(state, remaining)
+    best_price = price_from_hundredths(base_product_name, value)
+
+    if choice < 0:
+        print(f"\n{C_GREEN}Stop here:{C_RESET} no ingredient raises the price.")
+        return None
+    print(f"\nNext Ingredient: {C_GREEN}{ALL_INGREDIENTS[choice]}{C_RESET}")
+    formatted = ", ".join(f"{C_GREEN}{ing}{C_RESET}" for ing in sequence)
+    print(f"  Best Plan ({len(sequence)} ingredients): [{formatted}]")
+    print(f"  Resulting Effects: {C_DIM}{sorted(decode_effects(final_state))}{C_RESET}")
+    print(f"  {Style.BRIGHT}Best Price: {C_GREEN}${best_price}{C_RESET}")
+    return ALL_INGREDIENTS[choice]
+
+
+# --- Re-pricing ---
+# Which states a search reaches only depends on the transition rules; prices
+# only come in when ranking them. `expensive --save-states` keeps the explored
+# states (with parent links for the sequences), and `reprice` ranks them again
+# under changed multipliers or base prices without searching. The multiplier
+# sum of every state is computed in one pass per byte of effect bits, with a
+# 256-entry table of sums per byte.
+
+STATE_SET_MAGIC = b"S1SS"
+
+
+class ExploredStates:
+    """
+    The states find_most_expensive_products explored, in BFS order, with
+    the constraints they were explored under.
+    """
+
+    def __init__(
+        self,
+        states: array,
+        depths: array,
+        parents: array,
+        ingredients: array,
+        header: Dict,
+    ):
+        self.states = states  # 'Q'
+        self.depths = depths  # Unsigned, sized by VisitedTable
+        self.parents = parents  # 'i', entry number, -1 for the empty product
+        self.ingredients = ingredients  # 'b', index into ALL_INGREDIENTS
+        # max_ingredients, exclude_effects, ban_ingredients, max_effects, fingerprint
+        self.header = header
+
+    @classmethod
+    def from_table(
+        cls,
+        visited: VisitedTable,
+        max_ingredients: int,
+        constraints: SearchConstraints,
+    ) -> "ExploredStates":
+        header = {
+            "version": 1,
+            "fingerprint": rules_fingerprint(prices=False),
+            "max_ingredients": max_ingredients,
+            "exclude_effects": sorted(constraints.excluded_effects),
+            "ban_ingredients": sorted(constraints.banned_ingredients),
+            "max_effects": constraints.max_effects,
+        }
+        return cls(
+            visited.states, visited.depths, visited.parents, visited.ingredients, header
+        )
+
+    def save(self, path: str):
+        """Saves the states as a JSON header followed by the raw arrays."""
+        header = json.dumps(
+            dict(
+                self.header,
+                count=len(self.states),
+                byteorder=sys.byteorder,
+                depth_typecode=self.depths.typecode,
+            )
+        ).encode()
+        with open(path, "wb") as f:
+            f.write(STATE_SET_MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for column in (self.states, self.depths, self.parents, self.ingredients):
+                column.tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> "ExploredStates":
+        """
+        Loads saved states.
+
+        Raises:
+            ValueError: If the file is not a saved state set or was explored
+                        under different transition rules.
+        """
+        with open(path, "rb") as f:
+            if f.read(4) != STATE_SET_MAGIC:
+                raise ValueError(f"{path} is not a saved state set.")
+            (header_length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+            if header["fingerprint"] != rules_fingerprint(prices=False):
+                raise ValueError(
+                    f"{path} was explored under different ingredient rules; run expensive --save-states again."
+                )
+            count = header.pop("count")
+            byteorder = header.pop("byteorder")
+            depth_typecode = header.pop("depth_typecode", "B")
+
+            def read(typecode: str) -> array:
+                data = array(typecode)
+                data.fromfile(f, count)
+                if byteorder != sys.byteorder:
+                    data.byteswap()
+                return data
+
+            return cls(read("Q"), read(depth_typecode), read("i"), read("b"), header)
+
+    def constraints(self) -> SearchConstraints:
+        return build_search_constraints(
+            self.header["exclude_effects"],
+            self.header["ban_ingredients"],
+            self.header["max_effects"],
+        )
+
+    def sequence(self, entry: int) -> List[str]:
+        """Ingredients from the empty product to an entry."""
+        sequence = []
+        while self.parents[entry] >= 0:
+            sequence.append(ALL_INGREDIENTS[self.ingredients[entry]])
+            entry = self.parents[entry]
+        sequence.reverse()
+        return sequence
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+
+class PriceScenario(NamedTuple):
+    name: str
+    multipliers: Dict[str, float]
+    base_prices: Dict[str, float]
+
+
+def current_price_scenario() -> PriceScenario:
+    return PriceScenario("current prices", dict(EFFECT_MULTIPLIERS), dict(BASE_PRICES))
+
+
+def load_price_scenario(path: str) -> PriceScenario:
+    """
+    Loads a what-if file: a JSON object with optional "multipliers" (effect ->
+    multiplier) and "base_prices" (base product -> price) objects, overriding
+    the current tables.
+
+    Raises:
+        ValueError: If the file names unknown effects or base products.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    scenario = current_price_scenario()._replace(name=os.path.basename(path))
+    unknown_effects = set(data.get("multipliers", {})) - ALL_VALID_EFFECTS
+    if unknown_effects:
+        raise ValueError(f"{path}: unknown effects {sorted(unknown_effects)}")
+    unknown_products = set(data.get("base_prices", {})) - set(BASE_PRICES)
+    if unknown_products:
+        raise ValueError(f"{path}: unknown base products {sorted(unknown_products)}")
+    scenario.multipliers.update(data.get("multipliers", {}))
+    scenario.base_prices.update(data.get("base_prices", {}))
+    return scenario
+
+
+def multiplier_sums(states: array, multipliers: Dict[str, float]) -> List[int]:
+    """
+    The multiplier sum of each encoded state, in hundredths: one table
+    lookup per byte of effect bits instead of one step per effect.
+    """
+    hundredths = [round(multipliers.get(effect, 0.0) * 100) for effect in EFFECT_NAMES]
+    sums = [0] * len(states)
+    for shift in range(0, len(hundredths), 8):
+        chunk = hundredths[shift : shift + 8]
+        table = [
+            sum(value for b, value in enumerate(chunk) if byte >> b & 1)
+            for byte in range(256)
+        ]
+        sums = list(map(operator.add, sums, [table[s >> shift & 255] for s in states]))
+    return sums
+
+
+def rank_explored_states(
+    explored: ExploredStates,
+    sums: List[int],
+    candidates: List[int],
+    base_price: float,
+    num_results: int,
+) -> List[Tuple[int, int]]:
+    """
+    The top (price, entry) pairs among the candidate entries, ordered like
+    find_most_expensive_products: by price, then BFS order.
+    """
+    prices = {
+        entry: round(base_price * (100 + sums[entry]) / 100) for entry in candidates
+    }
+    top = nlargest(num_results, candidates, key=prices.__getitem__)
+    return [(prices[entry], entry) for entry in top]
+
+
+def run_repricing(
+    path: str,
+    what_if_paths: Optional[List[str]] = None,
+    base_products: Optional[List[str]] = None,
+    num_results: int = 5,
+):
+    """
+    Ranks saved explored states under the current prices and each what-if
+    file, and prints the top results per base product.
+
+    Args:
+        path: A file written by expensive --save-states.
+        what_if_paths: What-if files, see load_price_scenario.
+        base_products: Base products to rank for (default: all of BASE_PRICES).
+        num_results: Results per base product and scenario.
+    """
+    try:
+        explored = ExploredStates.load(path)
+        scenarios = [current_price_scenario()] + [
+            load_price_scenario(what_if) for what_if in what_if_paths or []
+        ]
+    except (OSError, ValueError) as e:
+        print(f"{C_RED}Error: {e}{C_RESET}")
+        return
+    base_products = base_products or list(BASE_PRICES)
+    constraints = explored.constraints()
+
+    print(
+        f"\n{Style.BRIGHT}Re-pricing{C_RESET} {C_MAGENTA}{len(explored)}{C_RESET} states "
+        f"(max {explored.header['max_ingredients']} ingredients) from {C_YELLOW}{path}{C_RESET}"
+    )
+    for line in constraints.describe():
+        print(f"  {line}")
+
+    candidates = [
+        entry
+        for entry, state in enumerate(explored.states)
+        if constraints.allows_final_mask(state)
+    ]
+    current_sums = multiplier_sums(explored.states, EFFECT_MULTIPLIERS)
+    summary = []
+    for scenario_index, scenario in enumerate(scenarios):
+        start = time.perf_counter()
+        sums = multiplier_sums(explored.states, scenario.multipliers)
+        print(
+            f"\n{Style.BRIGHT}Scenario: {C_CYAN}{scenario.name}{C_RESET} "
+            f"{C_DIM}(priced in {time.perf_counter() - start:.2f}s){C_RESET}"
+        )
+        best = []
+        for base_product in base_products:
+            base_price = scenario.base_prices[base_product]
+            top = rank_explored_states(
+                explored, sums, candidates, base_price, num_results
+            )
+            print(f"  {Style.BRIGHT}{base_product}{C_RESET} (${base_price})")
+            for i, (price, entry) in enumerate(top):
+                change = ""
+                if scenario_index:
+                    current = price_from_hundredths(base_product, current_sums[entry])
+                    change = f" {C_DIM}(now ${current}){C_RESET}"
+                sequence = explored.sequence(entry)
+                seq_str = (
+                    f"[{', '.join(f'{C_CYAN}{ing}{C_RESET}' for ing in sequence)}]"
+                    if sequence
+                    else "[](Base)"
+                )
+                print(f"    {i+1}. Price: {C_GREEN}${price}{C_RESET}{change}")
+                print(f"       Sequence ({len(sequence)} ingredients): {seq_str}")
+                print(
+                    f"       {C_DIM}Effects: {sorted(decode_effects(explored.states[entry]))}{C_RESET}"
+                )
+            best.append(top[0][0] if top else None)
+        summary.append((scenario.name, best))
+
+    if len(scenarios) > 1:
+        print(f"\n{Style.BRIGHT}Best price per scenario:{C_RESET}")
+        width = max(len(name) for name, _ in summary)
+        print(f"  {'':<{width}} " + " ".join(f"{p:>10}" for p in base_products))
+        for name, best in summary:
+            print(
+                f"  {name:<{width}} "
+                + " ".join(f"{'-' if b is None else '$' + str(b):>10}" for b in best)
+            )
+
+
+# --- Interactive Mixing Session ---
+# The session keeps one TransitionCache and a memo of remaining-path answers
+# for its whole lifetime, so later steps, undos and revisited states reuse the
+# work of earlier ones instead of starting from scratch.
+
+SESSION_HELP = """Commands:
+  <ingredient>        Add an ingredient (case-insensitive, e.g. mega bean)
+  undo                Remove the last ingredient
+  target EFFECT ...   Set the target effects (quote names with spaces)
+  target              Clear the target
+  reset               Remove all ingredients
+  show                Show the current product again
+  help                Show this help
+  quit                Leave the session"""
+
+
+class MixingSession:
+    """A product being mixed one ingredient at a time, with undo."""
+
+    def __init__(
+        self,
+        starting_effects: Optional[List[str]] = None,
+        target_effects: Optional[List[str]] = None,
+        max_ingredients: int = 8,
+    ):
+        start = frozenset(starting_effects or [])
+        # (effects, ingredient that produced them); the bottom entry is the start
+        self.stack: List[Tuple[FrozenSet[str], Optional[str]]] = [(start, None)]
+        self.target: FrozenSet[str] = frozenset(target_effects or [])
+        self.max_ingredients = max_ingredients
+        self.transition_cache = TransitionCache()
+        self._paths: Dict[Tuple[int, int], Optional[List[str]]] = {}
+
+    @property
+    def effects(self) -> FrozenSet[str]:
+        return self.stack[-1][0]
+
+    @property
+    def sequence(self) -> List[str]:
+        return [ingredient for _, ingredient in self.stack[1:]]
+
+    def add(self, ingredient: str) -> Tuple[Set[str], Set[str]]:
+        """Applies an ingredient; returns the (added, removed) effects."""
+        before = self.effects
+        after = frozenset(apply_ingredient_optimized(set(before), ingredient))
+        self.stack.append((after, ingredient))
+        return set(after - before), set(before - after)
+
+    def undo(self) -> Optional[str]:
+        """Removes the last ingredient and returns it (None if there is none)."""
+        if len(self.stack) == 1:
+            return None
+        return self.stack.pop()[1]
+
+    def reset(self):
+        del self.stack[1:]
+
+    @property
+    def remaining_budget(self) -> int:
+        """Ingredients that may still be added within max_ingredients."""
+        return max(0, self.max_ingredients - len(self.sequence))
+
+    def remaining_path(self) -> Optional[List[str]]:
+        """Shortest path from the current product to the target, within the
+        remaining ingredient budget (None if there is none)."""
+        budget = self.remaining_budget
+        key = (encode_effects(self.effects), budget)
+        if key not in self._paths:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self._paths[key] = find_shortest_sequences_for_strains(
+                    sorted(self.target),
+                    {"session": sorted(self.effects)},
+                    max_ingredients=budget,
+                    transition_cache=self.transition_cache,
+                )["session"]
+        return self._paths[key]
+
+    def set_target(self, target_effects: List[str]):
+        self.target = frozenset(target_effects)
+        self._paths.clear()  # Answers are per target
+
+    def print_status(
+        self, added: Optional[Set[str]] = None, removed: Optional[Set[str]] = None
+    ):
+        formatted = ", ".join(f"{C_GREEN}{ing}{C_RESET}" for ing in self.sequence)
+        print(f"\n  Ingredients ({len(self.sequence)}): [{formatted}]")
+        if added or removed:
+            changes = [f"{C_GREEN}+{eff}{C_RESET}" for eff in sorted(added or [])]
+            changes += [f"{C_RED}-{eff}{C_RESET}" for eff in sorted(removed or [])]
+            print(f"  Changes: {' '.join(changes)}")
+        print(f"  Effects: {C_YELLOW}{sorted(self.effects)}{C_RESET}")
+        prices = [
+            f"{name} {C_GREEN}${calculate_product_price(name, set(self.effects))}{C_RESET}"
+            for name in BASE_PRICES
+        ]
+        print(f"  Prices:  {', '.join(prices)}")
+        if self.target:
+            missing = sorted(self.target - self.effects)
+            if not missing:
+                print(f"  Target:  {C_GREEN}reached{C_RESET} {sorted(self.target)}")
+            else:
+                path = self.remaining_path()
+                if path is None:
+                    budget = self.remaining_budget
+                    print(
+                        f"  Target:  {C_RED}unreachable{C_RESET} within {budget} more "
+                        f"ingredient{'' if budget == 1 else 's'} (missing {missing})"
+                    )
+                else:
+                    formatted = ", ".join(f"{C_CYAN}{ing}{C_RESET}" for ing in path)
+                    print(f"  Target:  {len(path)} more: [{formatted}]")
+
+
+def run_mixing_session(
+    starting_effects: Optional[List[str]] = None,
+    product_name: Optional[str] = None,
+    target_effects: Optional[List[str]] = None,
+    max_ingredients: int = 8,
+    input_func: Callable[[str], str] = input,
+) -> MixingSession:
+    """
+    Runs an interactive mixing session until quit or end of input.
+
+    Args:
+        starting_effects: Effects the product starts with.
+        product_name: An optional name for the starting product.
+        target_effects: Effects to show the shortest remaining path to.
+        max_ingredients: The total ingredient limit for the remaining path.
+        input_func: Reads a line of input (the built-in input by default).
+
+    Returns:
+        The session as it was left.
+    """
+    def valid_effects(effects: List[str]) -> List[str]:
+        invalid = [eff for eff in effects if eff not in ALL_VALID_EFFECTS]
+        if invalid:
+            print(
+                f"{C_YELLOW}Warning:{C_RESET} Invalid effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+            )
+        return [eff for eff in effects if eff in ALL_VALID_EFFECTS]
+
+    session = MixingSession(
+        valid_effects(starting_effects or []),
+        valid_effects(target_effects or []),
+        max_ingredients,
+    )
+    ingredients_by_name = {ing.lower(): ing for ing in ALL_INGREDIENTS}
+    start_display_name = product_name or (
+        "Empty product" if not session.effects else "Unnamed product"
+    )
+    print(f"\n{Style.BRIGHT}Mixing Session{C_RESET} ({start_display_name})")
+    print(f"{C_DIM}Type an ingredient to add it, or 'help' for commands.{C_RESET}")
+    session.print_status()
+
+    while True:
+        try:
+            line = input_func(f"{C_MAGENTA}mix>{C_RESET} ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
+        if not line:
+            continue
+        command, _, rest = line.partition(" ")
+        command = command.lower()
+
+        if command in ("quit", "exit"):
+            break
+        elif command == "help":
+            print(SESSION_HELP)
+        elif command == "undo":
+            ingredient = session.undo()
+            if ingredient is None:
+                print(f"{C_YELLOW}Nothing to undo.{C_RESET}")
+            else:
+                print(f"Removed {C_RED}{ingredient}{C_RESET}")
+                session.print_status()
+        elif command == "reset":
+            session.reset()
+            session.print_status()
+        elif command == "show":
+            session.print_status()
+        elif command == "target":
+            try:
+                effects = shlex.split(rest)
+            except ValueError as e:
+                print(f"{C_RED}Error: {e}{C_RESET}")
+                continue
+            session.set_target(valid_effects(effects))
+            session.print_status()
+        elif line.lower() in ingredients_by_name:
+            added, removed = session.add(ingredients_by_name[line.lower()])
+            session.print_status(added, removed)
+        else:
+            print(
+                f"{C_RED}Unknown ingredient or command:{C_RESET} {line} (type 'help')"
+            )
+    return session
+
+
+# --- Graph Export ---
+# The reachable state graph is written while the BFS generates it: a node
+# record as soon as a state is discovered, then its edges when it is expanded,
+# so every edge follows the records of both of its nodes. Only the state -> id
+# map is kept in memory. Expanded states get one edge per ingredient (no-ops
+# show up as self-loops); states at the final depth are not expanded.
+#
+# Binary layout (little-endian): GRAPH_MAGIC, uint32 metadata length, JSON
+# metadata (effect/ingredient order, base prices, compiled rules, ...), then
+#   b"N" uint32 id, uint64 state, uint8 depth, uint16 price per base product
+#   b"E" uint32 source, uint8 ingredient index, uint32 target
+#   b"Z" uint32 node count, uint64 edge count   (end of file)
+
+GRAPH_MAGIC = b"S1GR"
+GRAPH_FORMATS = ["binary", "ndjson", "graphml"]
+
+
+class GraphNode(NamedTuple):
+    id: int
+    state: int
+    depth: int
+    prices: Tuple[int, ...]  # In BASE_PRICES order
+
+
+class GraphEdge(NamedTuple):
+    source: int
+    ingredient: int  # Index into ALL_INGREDIENTS
+    target: int
+
+
+def graph_metadata(depth: int, roots: List[int]) -> Dict:
+    """Everything needed to interpret (or update) an exported graph."""
+    return {
+        "version": 1,
+        "fingerprint": rules_fingerprint(),
+        "depth": depth,
+        "roots": roots,
+        "effects": EFFECT_NAMES,
+        "ingredients": ALL_INGREDIENTS,
+        "base_prices": BASE_PRICES,
+        "multipliers": EFFECT_MULTIPLIER_HUNDREDTHS,
+        "effect_cap": EFFECT_CAP,
+        "rules": [
+            [c.base_mask, list(map(list, c.rules)), list(map(list, c.guarded_rules))]
+            for c in COMPILED_INGREDIENTS
+        ],
+    }
+
+
+class BinaryGraphWriter:
+    def __init__(self, f, metadata: Dict):
+        self.f = f
+        self.node_format = struct.Struct(f"<cIQB{len(BASE_PRICES)}H")
+        self.edge_format = struct.Struct("<cIBI")
+        header = json.dumps(metadata).encode()
+        f.write(GRAPH_MAGIC + struct.pack("<I", len(header)) + header)
+
+    def write_node(self, node: GraphNode):
+        self.f.write(
+            self.node_format.pack(b"N", node.id, node.state, node.depth, *node.prices)
+        )
+
+    def write_edge(self, edge: GraphEdge):
+        self.f.write(self.edge_format.pack(b"E", *edge))
+
+    def close(self, num_nodes: int, num_edges: int):
+        self.f.write(struct.pack("<cIQ", b"Z", num_nodes, num_edges))
+
+
+class NdjsonGraphWriter:
+    def __init__(self, f, metadata: Dict):
+        self.f = f
+        f.write(json.dumps({"type": "meta", **metadata}) + "\n")
+
+    def write_node(self, node: GraphNode):
+        record = {
+            "type": "node",
+            "id": node.id,
+            "effects": sorted(decode_effects(node.state)),
+            "depth": node.depth,
+            "prices": dict(zip(BASE_PRICES, node.prices)),
+        }
+        self.f.write(json.dumps(record) + "\n")
+
+    def write_edge(self, edge: GraphEdge):
+        record = {
+            "type": "edge",
+            "source": edge.source,
+            "ingredient": ALL_INGREDIENTS[edge.ingredient],
+            "target": edge.target,
+        }
+        self.f.write(json.dumps(record) + "\n")
+
+    def close(self, num_nodes: int, num_edges: int):
+        pass
+
+
+class GraphmlGraphWriter:
+    def __init__(self, f, metadata: Dict):
+        self.f = f
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        f.write('  <key id="effects" for="node" attr.name="effects" attr.type="string"/>\n')
+        f.write('  <key id="depth" for="node" attr.name="depth" attr.type="int"/>\n')
+        for name in BASE_PRICES:
+            f.write(
+                f'  <key id="price_{name}" for="node" attr.name="price_{name}" attr.type="int"/>\n'
+            )
+        f.write(
+            '  <key id="ingredient" for="edge" attr.name="ingredient" attr.type="string"/>\n'
+        )
+        f.write('  <graph id="recipes" edgedefault="directed">\n')
+        f.write(f"    <desc>{escape(json.dumps(metadata))}</desc>\n")
+
+    def write_node(self, node: GraphNode):
+        effects = escape(",".join(sorted(decode_effects(node.state))))
+        data = f'<data key="effects">{effects}</data><data key="depth">{node.depth}</data>'
+        for name, price in zip(BASE_PRICES, node.prices):
+            data += f'<data key="price_{name}">{price}</data>'
+        self.f.write(f'    <node id="n{node.id}">{data}</node>\n')
+
+    def write_edge(self, edge: GraphEdge):
+        ingredient = escape(ALL_INGREDIENTS[edge.ingredient])
+        self.f.write(
+            f'    <edge source="n{edge.source}" target="n{edge.target}">'
+            f'<data key="ingredient">{ingredient}</data></edge>\n'
+        )
+
+    def close(self, num_nodes: int, num_edges: int):
+        self.f.write("  </graph>\n</graphml>\n")
+
+
+def state_prices(state: int) -> Tuple[int, ...]:
+    """The price of a state for every base product, in BASE_PRICES order."""
+    hundredths = mask_multiplier_hundredths(state)
+    return tuple(price_from_hundredths(name, hundredths) for name in BASE_PRICES)
+
+
+def iter_state_graph(
+    roots: List[int], depth: int
+) -> Iterator[Union[GraphNode, GraphEdge]]:
+    """
+    Generates the state graph breadth first: nodes as they are discovered,
+    edges as their source is expanded.
+    """
+    ids: Dict[int, int] = {}
+
+    def discover(state: int, state_depth: int) -> GraphNode:
+        ids[state] = len(ids)
+        return GraphNode(ids[state], state, state_depth, state_prices(state))
+
+    frontier = []
+    for root in roots:
+        if root not in ids:
+            yield discover(root, 0)
+            frontier.append(root)
+    for level in range(1, depth + 1):
+        next_frontier = []
+        for state in frontier:
+            source = ids[state]
+            for ingredient_index, compiled in enumerate(COMPILED_INGREDIENTS):
+                next_state = apply_ingredient_mask(state, compiled)
+                if next_state not in ids:
+                    yield discover(next_state, level)
+                    next_frontier.append(next_state)
+                yield GraphEdge(source, ingredient_index, ids[next_state])
+        frontier = next_frontier
+
+
+def export_state_graph(
+    output_path: str,
+    output_format: Optional[str] = None,
+    depth: int = 4,
+    starting_effects: Optional[List[str]] = None,
+) -> Tuple[int, int]:
+    """
+    Streams the reachable state graph to a file.
+
+    Args:
+        output_path: The file to write.
+        output_format: One of GRAPH_FORMATS (default: from the file extension,
+                       binary unless .ndjson/.jsonl or .graphml).
+        depth: How many ingredients from the starting states to explore.
+        starting_effects: Effects of the single starting state (default: every
+                          purchasable strain).
+
+    Returns:
+        (number of nodes, number of edges) written.
+    """
+    if output_format is None:
+        extension = os.path.splitext(output_path)[1].lower()
+        output_format = {".ndjson": "ndjson", ".jsonl": "ndjson", ".graphml": "graphml"}.get(
+            extension, "binary"
+        )
+    if starting_effects is None:
+        roots = [encode_effects(e) for e in STRAIN_STARTING_EFFECTS.values()]
+    else:
+        invalid = [eff for eff in starting_effects if eff not in ALL_VALID_EFFECTS]
+        if invalid:
+            print(
+                f"{C_YELLOW}Warning:{C_RESET} Invalid starting effects provided and ignored: {C_RED}{invalid}{C_RESET}"
+            )
+        roots = [encode_effects(e for e in starting_effects if e in ALL_VALID_EFFECTS)]
+
+    print(
+        f"\n{Style.BRIGHT}Exporting state graph{C_RESET} ({output_format}, depth {depth}) to {C_YELLOW}{output_path}{C_RESET}"
+    )
+    writer_class = {
+        "binary": BinaryGraphWriter,
+        "ndjson": NdjsonGraphWriter,
+        "graphml": GraphmlGraphWriter,
+    }[output_format]
+    mode = "wb" if output_format == "binary" else "w"
+    start = time.perf_counter()
+    num_nodes = num_edges = 0
+    with open(output_path, mode, buffering=1 << 20) as f:
+        writer = writer_class(f, graph_metadata(depth, roots))
+        for record in iter_state_graph(roots, depth):
+            if isinstance(record, GraphNode):
+                writer.write_node(record)
+                num_nodes += 1
+            else:
+                writer.write_edge(record)
+                num_edges += 1
+        writer.close(num_nodes, num_edges)
+
+    print(
+        f"  {C_GREEN}Wrote {num_nodes} nodes and {num_edges} edges{C_RESET} "
+        f"({os.path.getsize(output_path) / 1024:,.0f} KiB in {time.perf_counter() - start:.1f}s)"
+    )
+    return num_nodes, num_edges
+
+
+def open_binary_graph(path: str) -> Tuple[Dict, Iterator[Union[GraphNode, GraphEdge]]]:
+    """
+    Opens a binary graph export.
+
+    Returns:
+        The metadata, and an iterator over the node and edge records in file
+        order (the file is closed once it is exhausted).
+
+    Raises:
+        ValueError: If the file is not a binary graph export or is truncated.
+    """
+    f = open(path, "rb")
+    if f.read(4) != GRAPH_MAGIC:
+        f.close()
+        raise ValueError(f"{path} is not a binary graph export.")
+    (header_length,) = struct.unpack("<I", f.read(4))
+    metadata = json.loads(f.read(header_length))
+    node_format = struct.Struct(f"<IQB{len(metadata['base_prices'])}H")
+    edge_format = struct.Struct("<IBI")
+    end_format = struct.Struct("<IQ")
+
+    def records() -> Iterator[Union[GraphNode, GraphEdge]]:
+        with f:
+            while True:
+                tag = f.read(1)
+                if tag == b"E":
+                    yield GraphEdge(*edge_format.unpack(f.read(edge_format.size)))
+                elif tag == b"N":
+                    node_id, state, depth, *prices = node_format.unpack(
+                        f.read(node_format.size)
+                    )
+                    yield GraphNode(node_id, state, depth, tuple(prices))
+                elif tag == b"Z":
+                    end_format.unpack(f.read(end_format.size))
+                    return
+                else:
+                    raise ValueError(f"{path} is truncated or corrupt.")
+
+    return metadata, records()
+
+
+# --- Incremental Graph Update ---
+# An exported graph stores the compiled rules it was built with, so after a
+# rules change only the edges that can differ are recomputed:
+#  * An ingredient whose base effects changed, or any ingredient when the
+#    effect cap changed, may move every state.
+#  * Otherwise only the rules added or removed matter, and a rule never fires
+#    on a state that misses its trigger, so only states hitting one of those
+#    triggers can get a different successor.
+# The BFS is then replayed over the stored edges with the changed ones patched
+# in, which keeps node ids, depths and edge order exactly as a fresh export
+# would have them. Only states that were not expanded before (new states, or
+# old leaves that moved up a level) have every ingredient applied. Stored
+# prices are reused unless the multipliers or base prices changed.
+
+
+class RuleChange(NamedTuple):
+    ingredient: int  # Index into ALL_INGREDIENTS
+    trigger_mask: Optional[int]  # Edges from states hitting it may change; None for all
+    num_rules: int  # Rules added or removed
+    base_changed: bool
+
+
+def diff_compiled_rules(
+    old_rules: List, old_effect_cap: Optional[int]
+) -> List[RuleChange]:
+    """
+    Compares compiled rules saved by graph_metadata with COMPILED_INGREDIENTS.
+
+    Args:
+        old_rules: The "rules" entry of the graph metadata.
+        old_effect_cap: The effect cap the graph was built with.
+
+    Returns:
+        One RuleChange per ingredient whose transitions may differ.
+    """
+    changes = []
+    for index, ((old_base, old_plain, old_guarded), compiled) in enumerate(
+        zip(old_rules, COMPILED_INGREDIENTS)
+    ):
+        changed = set(map(tuple, old_plain)) ^ set(compiled.rules)
+        changed |= set(map(tuple, old_guarded)) ^ set(compiled.guarded_rules)
+        base_changed = old_base != compiled.base_mask
+        if base_changed or old_effect_cap != EFFECT_CAP:
+            changes.append(RuleChange(index, None, len(changed), base_changed))
+        elif changed:
+            trigger_mask = 0
+            for rule in changed:
+                trigger_mask |= rule[0]
+            changes.append(RuleChange(index, trigger_mask, len(changed), False))
+    return changes
+
+
+def update_state_graph(graph_path: str, output_path: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Brings a binary graph export up to date with the current rules, effect
+    cap and prices, recomputing only the edges the rules change touches. The
+    result is identical to exporting the graph again.
+
+    Args:
+        graph_path: A binary graph export.
+        output_path: The file to write (default: replace graph_path).
+
+    Returns:
+        (number of nodes, number of edges) written.
+
+    Raises:
+        ValueError: If the file is not a binary graph export, or was exported
+                    with a different effect or ingredient list.
+    """
+    if output_path is None:
+        output_path = graph_path
+    start = time.perf_counter()
+    with open(graph_path, "rb") as f:
+        data = f.read()
+    if data[:4] != GRAPH_MAGIC:
+        raise ValueError(f"{graph_path} is not a binary graph export.")
+    (header_length,) = struct.unpack_from("<I", data, 4)
+    body = 8 + header_length
+    metadata = json.loads(data[8:body])
+    if metadata["effects"] != EFFECT_NAMES or metadata["ingredients"] != ALL_INGREDIENTS:
+        raise ValueError(
+            f"{graph_path} was exported with a different effect or ingredient list; export it again."
+        )
+    depth = metadata["depth"]
+    roots = metadata["roots"]
+    num_ingredients = len(COMPILED_INGREDIENTS)
+    changes = diff_compiled_rules(metadata["rules"], metadata["effect_cap"])
+    reuse_prices = (
+        metadata["base_prices"] == BASE_PRICES
+        and metadata["multipliers"] == EFFECT_MULTIPLIER_HUNDREDTHS
+    )
+
+    print(
+        f"\n{Style.BRIGHT}Updating state graph{C_RESET} {C_YELLOW}{graph_path}{C_RESET} (depth {depth})"
+    )
+    if metadata["effect_cap"] != EFFECT_CAP:
+        print(
+            f"  {C_CYAN}Effect cap{C_RESET} changed from {metadata['effect_cap'] or 'none'} "
+            f"to {EFFECT_CAP or 'none'}, affects every state"
+        )
+    for change in changes:
+        what = [f"{change.num_rules} rules changed"] if change.num_rules else []
+        if change.base_changed:
+            what.append("base effects changed")
+        if not what:
+            continue  # Only the effect cap changed
+        if change.trigger_mask is None:
+            scope = "every state"
+        else:
+            scope = "states with " + ", ".join(sorted(decode_effects(change.trigger_mask)))
+        print(
+            f"  {C_CYAN}{ALL_INGREDIENTS[change.ingredient]}{C_RESET}: "
+            f"{', '.join(what)}, affects {scope}"
+        )
+    if not reuse_prices:
+        print(f"  {C_CYAN}Prices{C_RESET} changed")
+
+    temporary_path = output_path + ".tmp"
+
+    def rewrite_metadata() -> Tuple[int, int]:
+        # Same nodes, edges and prices: only the metadata needs replacing
+        with open(temporary_path, "wb") as f:
+            BinaryGraphWriter(f, graph_metadata(depth, roots))
+            f.write(memoryview(data)[body:])
+        os.replace(temporary_path, output_path)
+        return struct.unpack_from("<IQ", data, len(data) - 12)
+
+    if not changes and reuse_prices:
+        num_nodes, num_edges = rewrite_metadata()
+        print(f"  {C_GREEN}Already up to date{C_RESET} ({num_nodes} nodes, {num_edges} edges).")
+        return num_nodes, num_edges
+
+    # Index the stored records. Node ids are in file order, and the expanded
+    # nodes come first, each with one edge per ingredient in order.
+    node_size = struct.calcsize(f"<cIQB{len(metadata['base_prices'])}H")
+    unpack_state = struct.Struct("<Q").unpack_from
+    unpack_target = struct.Struct("<I").unpack_from
+    node_offsets = array("Q")
+    old_states = array("Q")
+    targets = array("I")
+    position = body
+    end = len(data) - 13  # The b"Z" record
+    while position < end:
+        tag = data[position]
+        if tag == 69:  # b"E"
+            targets.append(unpack_target(data, position + 6)[0])
+            position += 10
+        elif tag == 78:  # b"N"
+            node_offsets.append(position)
+            old_states.append(unpack_state(data, position + 5)[0])
+            position += node_size
+        else:
+            break
+    if position != end or data[end] != 90:  # b"Z"
+        raise ValueError(f"{graph_path} is truncated or corrupt.")
+    old_ids = dict(zip(old_states, range(len(old_states))))
+    expanded = len(targets) // num_ingredients
+
+    # Recompute the edges that can change, keeping those that did
+    patched: Dict[int, int] = {}  # Edge position -> new target state
+    recomputed = 0
+    for change in changes:
+        compiled = COMPILED_INGREDIENTS[change.ingredient]
+        trigger_mask = change.trigger_mask
+        for old_id in range(expanded):
+            state = old_states[old_id]
+            if trigger_mask is not None and not state & trigger_mask:
+                continue
+            recomputed += 1
+            edge = old_id * num_ingredients + change.ingredient
+            next_state = apply_ingredient_mask(state, compiled)
+            if next_state != old_states[targets[edge]]:
+                patched[edge] = next_state
+
+    if not patched and reuse_prices:
+        num_nodes, num_edges = rewrite_metadata()
+        added = moved = removed = newly_expanded = 0
+    else:
+        # Replay the BFS over the stored edges, patching the changed ones in
+        new_ids = array("i", [-1]) * len(old_states)  # By old id
+        extra_ids: Dict[int, int] = {}  # States the stored graph lacks
+        node_states = array("Q")
+        node_old_ids = array("i")
+        added = moved = newly_expanded = 0
+        num_edges = 0
+        pack_node = struct.Struct(f"<cIQB{len(BASE_PRICES)}H").pack
+        pack_edge = struct.Struct("<cIBI").pack
+        pack_id = struct.Struct("<I").pack
+
+        with open(temporary_path, "wb", buffering=1 << 20) as f:
+            BinaryGraphWriter(f, graph_metadata(depth, roots))
+            write = f.write
+
+            def discover(state: int, old_id: int, state_depth: int) -> int:
+                nonlocal added, moved
+                node_id = len(node_states)
+                node_states.append(state)
+                node_old_ids.append(old_id)
+                if old_id < 0:
+                    added += 1
+                    extra_ids[state] = node_id
+                    write(pack_node(b"N", node_id, state, state_depth, *state_prices(state)))
+                    return node_id
+                new_ids[old_id] = node_id
+                offset = node_offsets[old_id]
+                if data[offset + 13] != state_depth:
+                    moved += 1
+                if reuse_prices:
+                    write(
+                        b"N"
+                        + pack_id(node_id)
+                        + data[offset + 5 : offset + 13]
+                        + bytes((state_depth,))
+                        + data[offset + 14 : offset + node_size]
+                    )
+                else:
+                    write(pack_node(b"N", node_id, state, state_depth, *state_prices(state)))
+                return node_id
+
+            def node_for(state: int, state_depth: int) -> int:
+                old_id = old_ids.get(state, -1)
+                node_id = new_ids[old_id] if old_id >= 0 else extra_ids.get(state, -1)
+                if node_id < 0:
+                    node_id = discover(state, old_id, state_depth)
+                return node_id
+
+            for root in roots:
+                node_for(root, 0)
+            frontier_start = 0
+            for level in range(1, depth + 1):
+                frontier_end = len(node_states)
+                for source in range(frontier_start, frontier_end):
+                    old_id = node_old_ids[source]
+                    if 0 <= old_id < expanded:
+                        offset = old_id * num_ingredients
+                        for ingredient_index in range(num_ingredients):
+                            edge = offset + ingredient_index
+                            if edge in patched:
+                                node_id = node_for(patched[edge], level)
+                            else:
+                                target = targets[edge]
+                                node_id = new_ids[target]
+                                if node_id < 0:
+                                    node_id = discover(old_states[target], target, level)
+                            write(pack_edge(b"E", source, ingredient_index, node_id))
+                    else:
+                        newly_expanded += 1
+                        state = node_states[source]
+                        for ingredient_index, compiled in enumerate(COMPILED_INGREDIENTS):
+                            node_id = node_for(apply_ingredient_mask(state, compiled), level)
+                            write(pack_edge(b"E", source, ingredient_index, node_id))
+                num_edges += (frontier_end - frontier_start) * num_ingredients
+                frontier_start = frontier_end
+            num_nodes = len(node_states)
+            write(struct.pack("<cIQ", b"Z", num_nodes, num_edges))
+        os.replace(temporary_path, output_path)
+        removed = len(old_states) - (num_nodes - added)
+
+    print(
+        f"  Recomputed {C_MAGENTA}{recomputed}{C_RESET} of {len(targets)} stored edges "
+        f"({100 * recomputed / max(len(targets), 1):.1f}%), {C_MAGENTA}{len(patched)}{C_RESET} changed; "
+        f"{newly_expanded} states expanded from scratch"
+    )
+    print(
+        f"  States: {C_GREEN}+{added}{C_RESET} new, {C_RED}-{removed}{C_RESET} no longer reachable, "
+        f"{C_YELLOW}{moved}{C_RESET} at a new depth"
+    )
+    print(
+        f"  {C_GREEN}Wrote {num_nodes} nodes and {num_edges} edges{C_RESET} to {C_YELLOW}{output_path}{C_RESET} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    return num_nodes, num_edges
+
+
+# --- Query Result Cache ---
+# Results of slow queries are kept in a sqlite file, keyed by a hash of the
+# command, its normalized parameters, the rules fingerprint and BASE_PRICES, so
+# any change to the data simply misses. The printed output is stored with the
+# result and replayed on a hit. The least recently used entries are evicted
+# once the stored size passes the limit.
+
+QUERY_CACHE_PATH = "query_cache.sqlite"
+QUERY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class _TeeWriter(io.TextIOBase):
+    """Writes to the real stdout while keeping a copy."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = io.StringIO()
+
+    def write(self, text: str) -> int:
+        self.buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class QueryCache:
+    """On-disk cache of query results and their printed output."""
+
+    def __init__(
+        self, path: str = QUERY_CACHE_PATH, max_bytes: int = QUERY_CACHE_MAX_BYTES
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                command TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result TEXT NOT NULL,
+                output TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+
+    @staticmethod
+    def key(command: str, params: Dict) -> str:
+        payload = json.dumps(
+            [command, params, rules_fingerprint(), BASE_PRICES], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[object, str, float]]:
+        """Returns (result, output, creation time) or None on a miss."""
+        row = self.connection.execute(
+            "SELECT result, output, created FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.connection:
+            self.connection.execute(
+                "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0]), row[1], row[2]
+
+    def put(self, key: str, command: str, params: Dict, result: object, output: str):
+        encoded = json.dumps(result)
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    command,
+                    json.dumps(params, sort_keys=True),
+                    encoded,
+                    output,
+                    len(encoded) + len(output),
+                    now,
+                    now,
+                ),
+            )
+        self.evict()
+
+    def evict(self):
+        """Drops the least recently used entries until the size limit holds."""
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM results ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        with self.connection:
+            self.connection.executemany("DELETE FROM results WHERE key = ?", stale)
+
+    def close(self):
+        self.connection.close()
+
+
+def run_cached_query(
+    command: str,
+    params: Dict,
+    compute: Callable[[], object],
+    cache_path: str = QUERY_CACHE_PATH,
+    use_cache: bool = True,
+    refresh: bool = False,
+    decode: Optional[Callable[[object], object]] = None,
+) -> object:
+    """
+    Runs a query through the result cache.
+
+    Args:
+        command: Name of the query, part of the key.
+        params: The normalized query parameters (JSON serializable).
+        compute: Runs the query (printing as usual) and returns its result,
+                 which must be JSON serializable.
+        cache_path: The cache file.
+        use_cache: If False the cache is neither read nor written.
+        refresh: Recompute and overwrite any cached result.
+        decode: Converts a result loaded from JSON back to the usual type.
+
+    Returns:
+        The query result, computed or from the cache.
+    """
+    if not use_cache:
+        return compute()
+    try:
+        cache = QueryCache(cache_path)
+    except sqlite3.Error as e:
+        print(f"{C_YELLOW}Warning:{C_RESET} Result cache unavailable ({e}).")
+        return compute()
+
+    try:
+        key = QueryCache.key(command, params)
+        cached = None if refresh else cache.get(key)
+        if cached is not None:
+            result, output, created = cached
+            sys.stdout.write(output)
+            print(
+                f"{C_DIM}(Cached result from {time.strftime('%Y-%m-%d %H:%M', time.localtime(created))}, use --refresh to recompute){C_RESET}"
+            )
+            return decode(result) if decode else result
+
+        tee = _TeeWriter(sys.stdout)
+        with contextlib.redirect_stdout(tee):
+            result = compute()
+        cache.put(key, command, params, result, tee.buffer.getvalue())
+        return result
+    finally:
+        cache.close()
+
+
+# --- Benchmarks ---
+# Each case is timed best-of-N with stdout captured, then run once more under
+# tracemalloc for its peak memory (tracing slows Python down, so it is kept
+# out of the timed runs). "Items" are the units of work: applications or
+# prices computed, or for the searches the states reachable within the depth
+# that was searched, so rates stay comparable when an engine changes.
+
+BENCH_BASELINE_PATH = "bench_baseline.json"
+
+# name: (target_effects, starting_effects, max_ingredients)
+BENCH_SHORTEST_CORPUS = {
+    "easy": (["Focused", "Long-Faced", "Spicy"], ["Calming"], 6),
+    "hard": (["Shrinking", "Zombifying", "Cyclopean"], [], 7),
+    "impossible": (["Shrinking", "Zombifying", "Cyclopean", "Anti-Gravity"], [], 5),
+}
+
+
+class BenchmarkCase(NamedTuple):
+    name: str
+    run: Callable[[], object]
+    # Maps the result of run() to the number of items processed
+    workload: Callable[[object], int]
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    seconds: float
+    items: int
+    items_per_second: float
+    peak_kib: float
+
+
+def count_reachable_states(start_state: int, max_depth: int) -> int:
+    """Counts the distinct states reachable with at most max_depth ingredients."""
+    seen = {start_state}
+    frontier = [start_state]
+    for _ in range(max_depth):
+        next_frontier = []
+        for state in frontier:
+            for compiled in COMPILED_INGREDIENTS:
+                next_state = apply_ingredient_mask(state, compiled)
+                if next_state not in seen:
+                    seen.add(next_state)
+                    next_frontier.append(next_state)
+        frontier = next_frontier
+    return len(seen)
+
+
+def build_benchmark_cases(max_depth: int = 5) -> List[BenchmarkCase]:
+    """
+    Builds the benchmark suite.
+
+    Args:
+        max_depth: The deepest find_most_expensive_products run (from depth 3).
+
+    Returns:
+        The benchmark cases, in the order they should be run.
+    """
+    # Every state within 3 ingredients of an empty product, as effect sets
+    layer = {0}
+    seen = {0}
+    for _ in range(3):
+        layer = {
+            apply_ingredient_mask(state, compiled)
+            for state in layer
+            for compiled in COMPILED_INGREDIENTS
+        } - seen
+        seen |= layer
+    sample_states = [decode_effects(state) for state in sorted(seen)]
+    sample_masks = sorted(seen)
+
+    def bench_apply():
+        for effects in sample_states:
+            for ingredient in ALL_INGREDIENTS:
+                apply_ingredient_optimized(effects, ingredient)
+
+    def bench_apply_mask():
+        for state in sample_masks:
+            for compiled in COMPILED_INGREDIENTS:
+                apply_ingredient_mask(state, compiled)
+
+    def bench_price():
+        for effects in sample_states:
+            for base_product in BASE_PRICES:
+                calculate_product_price(base_product, effects)
+
+    applications = len(sample_states) * len(ALL_INGREDIENTS)
+    cases = [
+        BenchmarkCase("apply", bench_apply, lambda _: applications),
+        BenchmarkCase("apply_mask", bench_apply_mask, lambda _: applications),
+        BenchmarkCase(
+            "price",
+            bench_price,
+            lambda _: len(sample_states) * len(BASE_PRICES),
+        ),
+    ]
+
+    for name, (targets, starting, limit) in BENCH_SHORTEST_CORPUS.items():
+        start_state = encode_effects(starting)
+        for prefix, bidirectional in (
+            ("shortest", False),
+            ("bidirectional", True),
+        ):
+            cases.append(
+                BenchmarkCase(
+                    f"{prefix}/{name}",
+                    lambda targets=targets, starting=starting, limit=limit, bidirectional=bidirectional: (
+                        find_shortest_product_sequence(
+                            targets,
+                            starting,
+                            max_ingredients=limit,
+                            bidirectional=bidirectional,
+                        )
+                    ),
+                    # The forward search stops in the layer of its solution;
+                    # both modes are measured against that work
+                    lambda result, start_state=start_state, limit=limit: (
+                        count_reachable_states(
+                            start_state, len(result) if result else limit
+                        )
+                    ),
+                )
+            )
+
+    reachable = {}  # depth -> states, shared by all base products
+    for base_product in BASE_PRICES:
+        for depth in range(3, max_depth + 1):
+            cases.append(
+                BenchmarkCase(
+                    f"expensive/{base_product}/{depth}",
+                    lambda base_product=base_product, depth=depth: (
+                        find_most_expensive_products(base_product, depth)
+                    ),
+                    lambda _, depth=depth: reachable.setdefault(
+                        depth, count_reachable_states(0, depth)
+                    ),
+                )
+            )
+    return cases
+
+
+def run_benchmark_case(case: BenchmarkCase, repeat: int = 3) -> BenchmarkResult:
+    """Times a case (best of repeat runs) and measures its peak traced memory."""
+    sink = io.StringIO()
+    best = float("inf")
+    result = None
+    for _ in range(max(1, repeat)):
+        with contextlib.redirect_stdout(sink):
+            start = time.perf_counter()
+            result = case.run()
+            best = min(best, time.perf_counter() - start)
+        sink.seek(0)
+        sink.truncate()
+
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(sink):
+            case.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    items = case.workload(result)
+    return BenchmarkResult(
+        name=case.name,
+        seconds=best,
+        items=items,
+        items_per_second=items / best if best > 0 else 0.0,
+        peak_kib=peak / 1024,
+    )
+
+
+def find_benchmark_regressions(
+    results: List[BenchmarkResult], baseline: Dict, threshold: float = 0.2
+) -> List[Tuple[str, str, float, float]]:
+    """
+    Compares results against a saved baseline.
+
+    Args:
+        results: The results of this run.
+        baseline: A baseline as saved by run_benchmarks.
+        threshold: The relative slowdown (or memory growth) that counts as a
+                   regression, e.g. 0.2 for 20%.
+
+    Returns:
+        (name, metric, baseline value, new value) for every regression.
+    """
+    regressions = []
+    baseline_results = baseline.get("results", {})
+    for result in results:
+        previous = baseline_results.get(result.name)
+        if previous is None:
+            continue
+        # Small absolute floors keep timer and allocator noise on the tiny
+        # cases from being reported
+        if (
+            result.seconds > previous["seconds"] * (1 + threshold)
+            and result.seconds - previous["seconds"] > 0.005
+        ):
+            regressions.append(
+                (result.name, "seconds", previous["seconds"], result.seconds)
+            )
+        if (
+            result.peak_kib > previous["peak_kib"] * (1 + threshold)
+            and result.peak_kib - previous["peak_kib"] > 64
+        ):
+            regressions.append(
+                (result.name, "peak_kib", previous["peak_kib"], result.peak_kib)
+            )
+    return regressions
+
+
+def run_benchmarks(
+    max_depth: int = 5,
+    repeat: int = 3,
+    only: Optional[List[str]] = None,
+    baseline_path: str = BENCH_BASELINE_PATH,
+    save_baseline: bool = False,
+    output_path: Optional[str] = None,
+    threshold: float = 0.2,
+) -> List[Tuple[str, str, float, float]]:
+    """
+    Runs the benchmark suite and reports regressions against a baseline.
+
+    Args:
+        max_depth: The deepest find_most_expensive_products run.
+        repeat: Timed runs per case; the best time is kept.
+        only: If provided, only cases whose name starts with one of these.
+        baseline_path: JSON baseline to compare against (and to save to).
+        save_baseline: Whether to store this run as the new baseline.
+        output_path: If provided, this run is also written there as JSON.
+        threshold: The relative change that counts as a regression.
+
+    Returns:
+        The regressions found, see find_benchmark_regressions.
+    """
+    cases = [
+        case
+        for case in build_benchmark_cases(max_depth)
+        if not only or any(case.name.startswith(prefix) for prefix in only)
+    ]
+
+    print(
+        f"\n{Style.BRIGHT}Running {len(cases)} benchmarks{C_RESET} (best of {repeat})"
+    )
+    print(
+        f"  {'Benchmark':<24} {'Seconds':>10} {'Items':>10} {'Items/s':>12} {'Peak KiB':>10}"
+    )
+    results = []
+    for case in cases:
+        result = run_benchmark_case(case, repeat)
+        results.append(result)
+        print(
+            f"  {C_CYAN}{result.name:<24}{C_RESET} {result.seconds:>10.4f} {result.items:>10} "
+            f"{result.items_per_second:>12,.0f} {result.peak_kib:>10,.0f}"
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {result.name: result._asdict() for result in results},
+    }
+
+    regressions = []
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = find_benchmark_regressions(results, baseline, threshold)
+        print(
+            f"\nCompared against baseline {C_YELLOW}{baseline_path}{C_RESET} ({baseline.get('created', 'unknown date')})"
+        )
+        if regressions:
+            for name, metric, before, after in regressions:
+                print(
+                    f"  {C_RED}Regression:{C_RESET} {name} {metric} {before:,.4f} -> {after:,.4f} "
+                    f"({(after / before - 1) * 100:+.0f}%)"
+                )
+        else:
+            print(
+                f"  {C_GREEN}No regressions{C_RESET} (threshold {threshold * 100:.0f}%)"
+            )
+    elif not save_baseline:
+        print(
+            f"\n{C_DIM}No baseline at {baseline_path}; use --save-baseline to store one.{C_RESET}"
+        )
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {C_YELLOW}{output_path}{C_RESET}")
+    if save_baseline:
+        if os.path.exists(baseline_path):
+            # Cases outside this run (e.g. excluded by --only) keep their entries
+            with open(baseline_path) as f:
+                previous_results = json.load(f).get("results", {})
+            report["results"] = {**previous_results, **report["results"]}
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {C_YELLOW}{baseline_path}{C_RESET}")
+    return regressions
+
+
+# --- Profiling ---
+# `main.py --profile <command> ...` runs any command under a profiler. cProfile
+# counts every Python call exactly, but slows call-heavy code a lot.
+# The sampling profiler only looks at the main thread's stack every few
+# milliseconds. It barely slows the command and records whole stacks, which
+# are written in the collapsed format read by flamegraph.pl and speedscope.
+
+PROFILE_OUTPUT_PREFIX = "profile"
+PROFILERS = ["cprofile", "sample"]
+
+
+def _frame_label(filename: str, line: int, name: str) -> str:
+    if filename == "~":  # Built-in functions
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class CommandProfiler:
+    """Profiles the main thread between start() and stop()."""
+
+    def __init__(self, mode: str = "cprofile", interval: float = 0.005):
+        self.mode = mode
+        self.interval = interval
+        self.profile: Optional[cProfile.Profile] = None
+        self.stacks: collections.Counter = collections.Counter()
+        self.seconds = 0.0
+        self._started = 0.0
+        self._running = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self._running.set()
+            self._thread = threading.Thread(
+                target=self._sample, args=(threading.get_ident(),), daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        if self._thread is not None:
+            self._running.clear()
+            self._thread.join()
+        self.seconds = time.perf_counter() - self._started
+
+    def _sample(self, thread_id: int):
+        while True:
+            time.sleep(self.interval)
+            if not self._running.is_set():
+                break  # Do not sample stop() waiting for this thread
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_frame_label(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def save(self, prefix: str = PROFILE_OUTPUT_PREFIX) -> str:
+        """Writes <prefix>.pstats (cprofile) or <prefix>.folded (sample); returns the path."""
+        if self.profile is not None:
+            path = f"{prefix}.pstats"
+            self.profile.dump_stats(path)
+        else:
+            path = f"{prefix}.folded"
+            with open(path, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        return path
+
+    def hot_functions(self, top: int = 15) -> List[Tuple[str, int, float, float]]:
+        """
+        The functions with the most time of their own.
+
+        Returns:
+            [(function, calls, own seconds, total seconds), ...]. Calls is -1
+            for sampled profiles, whose times are estimated from the samples.
+        """
+        if self.profile is not None:
+            rows = [
+                (_frame_label(*key), calls, own, total)
+                for key, (_, calls, own, total, _) in pstats.Stats(self.profile).stats.items()
+            ]
+        else:
+            own: collections.Counter = collections.Counter()
+            total: collections.Counter = collections.Counter()
+            for stack, count in self.stacks.items():
+                frames = stack.split(";")
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    total[frame] += count
+            rows = [
+                (frame, -1, own[frame] * self.interval, total[frame] * self.interval)
+                for frame in total
+            ]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:top]
+
+
+def print_profile_report(profiler: CommandProfiler, path: str, top: int = 15):
+    """Prints where the profiled command spent its time."""
+    mode = "cProfile" if profiler.mode == "cprofile" else f"sampled every {profiler.interval * 1000:g} ms"
+    print(
+        f"\n{Style.BRIGHT}Profile{C_RESET} ({mode}): {C_MAGENTA}{profiler.seconds:.3f}s{C_RESET}, saved to {C_YELLOW}{path}{C_RESET}"
+    )
+    if profiler.mode == "sample":
+        print(f"  {C_DIM}{sum(profiler.stacks.values())} samples{C_RESET}")
+    print(f"  {'Own s':>8} {'Own %':>6} {'Total s':>8} {'Calls':>10}  Function")
+    for name, calls, own, total in profiler.hot_functions(top):
+        share = 100 * own / profiler.seconds if profiler.seconds else 0.0
+        calls_str = "-" if calls < 0 else str(calls)
+        print(
+            f"  {own:>8.3f} {share:>5.1f}% {total:>8.3f} {calls_str:>10}  {C_CYAN}{name}{C_RESET}"
+        )
+
+
+# --- Differential Verification ---
+# Every accelerated engine is checked against the plain set-based
+# implementation: apply_ingredient_optimized for transitions, calculate_product_price
+# for prices, and an unpruned set-based BFS for the searches. New engines are
+# verified by adding them to the registries below.
+
+
+def _transition_cache_engine() -> Callable[[FrozenSet[str], str], Set[str]]:
+    cache = TransitionCache()
+    return lambda effects, ingredient: decode_effects(
+        cache.apply(encode_effects(effects), INGREDIENT_INDEX[ingredient])
+    )
+
+
+# Name -> factory returning a transition function, so stateful (cached)
+# engines start fresh on every verification run
+TRANSITION_ENGINES: Dict[
+    str, Callable[[], Callable[[FrozenSet[str], str], Set[str]]]
+] = {
+    "mask": lambda: lambda effects, ingredient: decode_effects(
+        apply_ingredient_mask(
+            encode_effects(effects), COMPILED_INGREDIENTS[INGREDIENT_INDEX[ingredient]]
+        )
+    ),
+    "transition_cache": _transition_cache_engine,
+}
+
+# Name -> (base_product, effects) -> price
+PRICE_ENGINES: Dict[str, Callable[[str, FrozenSet[str]], int]] = {
+    "mask": lambda base_product, effects: calculate_mask_price(
+        base_product, encode_effects(effects)
+    ),
+}
+
+# Name -> (target_effects, starting_effects, max_ingredients) -> sequence or None
+SHORTEST_ENGINES: Dict[
+    str, Callable[[List[str], List[str], int], Optional[List[str]]]
+] = {
+    "shortest": lambda targets, starting, limit: find_shortest_product_sequence(
+        targets, starting, max_ingredients=limit
+    ),
+    "bidirectional": lambda targets, starting, limit: find_shortest_product_sequence(
+        targets, starting, max_ingredients=limit, bidirectional=True
+    ),
+    "alternatives": lambda targets, starting, limit: next(
+        iter_shortest_product_sequences(targets, starting, limit), None
+    ),
+    "strains": lambda targets, starting, limit: find_shortest_sequences_for_strains(
+        targets, {"verify": starting}, max_ingredients=limit
+    )["verify"],
+}
+
+# Name -> (target_effects, starting_effects, max_ingredients, constraints) ->
+# sequence or None, for the engines that take search constraints. The
+# constraints are the exclude_effects, ban_ingredients and max_effects keyword
+# arguments of find_shortest_product_sequence.
+CONSTRAINED_SHORTEST_ENGINES: Dict[
+    str, Callable[[List[str], List[str], int, Dict], Optional[List[str]]]
+] = {
+    "shortest": lambda targets, starting, limit, constraints: find_shortest_product_sequence(
+        targets, starting, max_ingredients=limit, **constraints
+    ),
+    "bidirectional": lambda targets, starting, limit, constraints: find_shortest_product_sequence(
+        targets, starting, max_ingredients=limit, bidirectional=True, **constraints
+    ),
+    "alternatives": lambda targets, starting, limit, constraints: next(
+        iter_shortest_product_sequences(
+            targets, starting, limit, build_search_constraints(**constraints)
+        ),
+        None,
+    ),
+}
+
+# Effect caps the constrained shortest cases run under, besides the current one
+VERIFY_EFFECT_CAPS: List[Optional[int]] = [3, 5, None]
+
+# Name -> (base_product, max_ingredients, num_results) -> [(price, sequence, effects)]
+EXPENSIVE_ENGINES: Dict[
+    str, Callable[[str, int, int], List[Tuple[int, List[str], Set[str]]]]
+] = {
+    "expensive": lambda base_product, limit, k: find_most_expensive_products(
+        base_product, limit, num_results=k
+    ),
+}
+
+VERIFY_CHECKS = ["transitions", "prices", "shortest", "expensive"]
+
+
+class VerificationFailure(NamedTuple):
+    check: str
+    engine: str
+    case: str
+    expected: object
+    actual: object
+
+
+def reference_reachable_states(
+    starting_effects: List[str],
+    max_depth: int,
+    ban_ingredients: Optional[List[str]] = None,
+) -> Dict[FrozenSet[str], int]:
+    """
+    Plain set-based BFS without any pruning.
+
+    Args:
+        starting_effects: Effects of the starting state.
+        max_depth: Most ingredients to add.
+        ban_ingredients: Ingredients never added.
+
+    Returns:
+        Every state reachable with at most max_depth ingredients -> the
+        fewest ingredients reaching it.
+    """
+    ingredients = [i for i in ALL_INGREDIENTS if i not in (ban_ingredients or [])]
+    start = frozenset(starting_effects)
+    depths = {start: 0}
+    frontier = [start]
+    for depth in range(1, max_depth + 1):
+        next_frontier = []
+        for effects in frontier:
+            for ingredient in ingredients:
+                next_effects = frozenset(apply_ingredient_optimized(set(effects), ingredient))
+                if next_effects not in depths:
+                    depths[next_effects] = depth
+                    next_frontier.append(next_effects)
+        frontier = next_frontier
+    return depths
+
+
+def reference_apply_sequence(
+    starting_effects: List[str], sequence: List[str]
+) -> FrozenSet[str]:
+    """Replays a sequence with the reference implementation."""
+    effects = set(starting_effects)
+    for ingredient in sequence:
+        effects = apply_ingredient_optimized(effects, ingredient)
+    return frozenset(effects)
+
+
+def verify_transitions(
+    engines: List[str], max_depth: int, rng: random.Random, num_random: int
+) -> Tuple[int, Optional[VerificationFailure]]:
+    """Compares transitions exhaustively up to max_depth, then along random sequences."""
+    appliers = {name: TRANSITION_ENGINES[name]() for name in engines}
+    checked = 0
+    for effects in reference_reachable_states([], max_depth):
+        for ingredient in ALL_INGREDIENTS:
+            expected = apply_ingredient_optimized(set(effects), ingredient)
+            for name, apply in appliers.items():
+                actual = apply(effects, ingredient)
+                checked += 1
+                if actual != expected:
+                    return checked, VerificationFailure(
+                        "transitions",
+                        name,
+                        f"{sorted(effects)} + {ingredient}",
+                        sorted(expected),
+                        sorted(actual),
+                    )
+
+    # Random sequences go past the exhaustive depth and start from each strain
+    starts = list(STRAIN_STARTING_EFFECTS.values())
+    for _ in range(num_random):
+        starting = rng.choice(starts)
+        sequence = [
+            rng.choice(ALL_INGREDIENTS) for _ in range(rng.randint(1, 2 * max_depth + 4))
+        ]
+        for name, apply in appliers.items():
+            expected = set(starting)
+            actual = frozenset(starting)
+            for step, ingredient in enumerate(sequence, 1):
+                expected = apply_ingredient_optimized(expected, ingredient)
+                actual = frozenset(apply(actual, ingredient))
+                checked += 1
+                if actual != expected:
+                    return checked, VerificationFailure(
+                        "transitions",
+                        name,
+                        f"{sorted(starting)} + {sequence[:step]}",
+                        sorted(expected),
+                        sorted(actual),
+                    )
+    return checked, None
+
+
+def verify_prices(
+    engines: List[str], max_depth: int
+) -> Tuple[int, Optional[VerificationFailure]]:
+    """Compares prices for every state reachable up to max_depth."""
+    checked = 0
+    for effects in reference_reachable_states([], max_depth):
+        for base_product in BASE_PRICES:
+            expected = calculate_product_price(base_product, set(effects))
+            for name in engines:
+                actual = PRICE_ENGINES[name](base_product, effects)
+                checked += 1
+                if actual != expected:
+                    return checked, VerificationFailure(
+                        "prices",
+                        name,
+                        f"{base_product} {sorted(effects)}",
+                        expected,
+                        actual,
+                    )
+    return checked, None
+
+
+def verify_shortest(
+    engines: List[str], max_depth: int, rng: random.Random, num_targets: int
+) -> Tuple[int, Optional[VerificationFailure]]:
+    """
+    Compares shortest lengths for random targets from every strain, and
+    checks each returned sequence replays to the target. The engines taking
+    search constraints are also run on half as many targets per strain with
+    random excluded effects, banned ingredients and effect limits under each
+    of VERIFY_EFFECT_CAPS, against a reference BFS applying the same
+    constraints.
+    """
+    checked = 0
+    effect_names = sorted(ALL_VALID_EFFECTS)
+    constrained = [name for name in engines if name in CONSTRAINED_SHORTEST_ENGINES]
+    scenarios = [(EFFECT_CAP, False)] + [
+        (cap, True) for cap in VERIFY_EFFECT_CAPS if constrained
+    ]
+    current_cap = EFFECT_CAP
+    try:
+        for cap, with_constraints in scenarios:
+            set_effect_cap(cap)
+            for strain, starting in STRAIN_STARTING_EFFECTS.items():
+                ban = rng.sample(ALL_INGREDIENTS, rng.randint(0, 2)) if with_constraints else []
+                reachable = reference_reachable_states(starting, max_depth, ban)
+                reachable_states = list(reachable)
+                for target_index in range(
+                    max(1, num_targets // 2) if with_constraints else num_targets
+                ):
+                    if target_index % 2:
+                        # Arbitrary targets, often impossible within the limit
+                        effects = rng.sample(effect_names, rng.randint(1, 3))
+                        targets = effects
+                    else:
+                        # Targets taken from a reachable state always have a
+                        # solution unless constraints rule it out
+                        effects = sorted(rng.choice(reachable_states))
+                        targets = rng.sample(effects, min(len(effects), rng.randint(1, 3)))
+                    constraints: Dict = {}
+                    if with_constraints:
+                        # Mostly effects the picked state lacks, so it stays a
+                        # solution, and limits around its size
+                        others = [e for e in effect_names if e not in effects]
+                        constraints = {
+                            "exclude_effects": rng.sample(others, rng.randint(0, 2)),
+                            "ban_ingredients": ban,
+                            "max_effects": rng.choice(
+                                [None, len(targets), len(effects), len(effects) + 1]
+                            ),
+                        }
+                    failure = _compare_shortest(
+                        engines if not with_constraints else constrained,
+                        starting,
+                        targets,
+                        constraints,
+                        reachable,
+                        f"{strain} -> {sorted(targets)} (max {max_depth}, cap {cap}"
+                        + "".join(f", {k} {v}" for k, v in constraints.items() if v)
+                        + ")",
+                        max_depth,
+                    )
+                    checked += len(constrained) if with_constraints else len(engines)
+                    if failure is not None:
+                        return checked, failure
+    finally:
+        set_effect_cap(current_cap)
+    return checked, None
+
+
+def _compare_shortest(
+    engines: List[str],
+    starting: List[str],
+    targets: List[str],
+    constraints: Dict,
+    reachable: Dict[FrozenSet[str], int],
+    case: str,
+    max_depth: int,
+) -> Optional[VerificationFailure]:
+    """Runs one shortest case on the engines; the first divergence, if any."""
+    target_set = set(targets)
+    excluded = set(constraints.get("exclude_effects") or [])
+    banned = set(constraints.get("ban_ingredients") or [])
+    max_effects = constraints.get("max_effects")
+
+    def solves(effects: FrozenSet[str]) -> bool:
+        return (
+            target_set <= effects
+            and effects.isdisjoint(excluded)
+            and (max_effects is None or len(effects) <= max_effects)
+        )
+
+    expected = min(
+        (depth for effects, depth in reachable.items() if solves(effects)),
+        default=None,
+    )
+    for name in engines:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if constraints:
+                sequence = CONSTRAINED_SHORTEST_ENGINES[name](
+                    targets, starting, max_depth, constraints
+                )
+            else:
+                sequence = SHORTEST_ENGINES[name](targets, starting, max_depth)
+        actual = None if sequence is None else len(sequence)
+        if actual != expected:
+            return VerificationFailure("shortest", name, case, expected, sequence)
+        if sequence is not None and (
+            banned.intersection(sequence)
+            or not solves(reference_apply_sequence(starting, sequence))
+        ):
+            return VerificationFailure(
+                "shortest",
+                name,
+                case,
+                "a sequence reaching the target within the constraints",
+                sequence,
+            )
+    return None
+
+
+def verify_expensive(
+    engines: List[str], max_depth: int, num_results: int = 10
+) -> Tuple[int, Optional[VerificationFailure]]:
+    """
+    Compares the top prices for each base product, and checks each returned
+    sequence replays to the reported effects and price.
+    """
+    checked = 0
+    reachable = reference_reachable_states([], max_depth)
+    for base_product in BASE_PRICES:
+        expected = sorted(
+            (calculate_product_price(base_product, set(effects)) for effects in reachable),
+            reverse=True,
+        )[:num_results]
+        case = f"{base_product} (max {max_depth})"
+        for name in engines:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = EXPENSIVE_ENGINES[name](base_product, max_depth, num_results)
+            checked += 1
+            actual = [price for price, _, _ in results]
+            if actual != expected:
+                return checked, VerificationFailure(
+                    "expensive", name, case, expected, actual
+                )
+            for price, sequence, effects in results:
+                replayed = reference_apply_sequence([], sequence)
+                if (
+                    len(sequence) > max_depth
+                    or replayed != frozenset(effects)
+                    or calculate_product_price(base_product, set(replayed)) != price
+                ):
+                    return checked, VerificationFailure(
+                        "expensive",
+                        name,
+                        f"{case} {sequence}",
+                        (price, sorted(effects)),
+                        (
+                            calculate_product_price(base_product, set(replayed)),
+                            sorted(replayed),
+                        ),
+                    )
+    return checked, None
+
+
+def run_verification(
+    max_depth: int = 4,
+    seed: int = 0,
+    num_random: int = 200,
+    num_targets: int = 20,
+    checks: Optional[List[str]] = None,
+    engines: Optional[List[str]] = None,
+) -> Optional[VerificationFailure]:
+    """
+    Verifies the accelerated engines against the reference implementation.
+
+    Args:
+        max_depth: Depth of the exhaustive checks and the search limit.
+        seed: Seed for the random sequences and targets.
+        num_random: Random ingredient sequences for the transition check.
+        num_targets: Random targets per strain for the shortest check.
+        checks: Checks to run (default: all of VERIFY_CHECKS).
+        engines: If provided, only engines with these names are verified.
+
+    Returns:
+        The first divergence found, or None when everything matches.
+    """
+    rng = random.Random(seed)
+    registries = {
+        "transitions": TRANSITION_ENGINES,
+        "prices": PRICE_ENGINES,
+        "shortest": SHORTEST_ENGINES,
+        "expensive": EXPENSIVE_ENGINES,
+    }
+    print(
+        f"\n{Style.BRIGHT}Verifying engines{C_RESET} against the reference implementation"
+    )
+    print(f"  Depth: {C_MAGENTA}{max_depth}{C_RESET}, seed: {C_MAGENTA}{seed}{C_RESET}")
+
+    for check in checks or VERIFY_CHECKS:
+        selected = [
+            name for name in registries[check] if engines is None or name in engines
+        ]
+        if not selected:
+            continue
+        if check == "transitions":
+            checked, failure = verify_transitions(selected, max_depth, rng, num_random)
+        elif check == "prices":
+            checked, failure = verify_prices(selected, max_depth)
+        elif check == "shortest":
+            checked, failure = verify_shortest(selected, max_depth, rng, num_targets)
+        else:
+            checked, failure = verify_expensive(selected, max_depth)
+
+        if failure is not None:
+            print(
+                f"\n{C_RED}Divergence in {failure.check}{C_RESET} (engine {C_YELLOW}{failure.engine}{C_RESET}, after {checked} comparisons)"
+            )
+            print(f"  Case:     {failure.case}")
+            print(f"  Expected: {C_GREEN}{failure.expected}{C_RESET}")
+            print(f"  Actual:   {C_RED}{failure.actual}{C_RESET}")
+            return failure
+        print(
+            f"  {C_GREEN}✓ {check}{C_RESET}: {checked} comparisons match ({', '.join(selected)})"
+        )
+    return None
+
 
-
 # if __name__ == "__main__":
 #     try_all_ingredients(
 #         ["Shrinking", "Zombifying", "Cyclopean", "Anti-Gravity", "Long-Faced"]
@@ -944,13 +5168,70 @@ def main():
         description=f"{Style.BRIGHT}Product Calculator CLI{C_RESET}",
         formatter_class=argparse.RawTextHelpFormatter,  # Allows better formatting in help
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the command and print its hottest functions.",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=PROFILERS,
+        default="cprofile",
+        help="cprofile: exact call counts, writes <output>.pstats.\nsample: low overhead, writes collapsed stacks to <output>.folded (default: cprofile).",
+    )
+    parser.add_argument(
+        "--profile-output",
+        default=PROFILE_OUTPUT_PREFIX,
+        help=f"Profile file name without extension (default: {PROFILE_OUTPUT_PREFIX}).",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=15,
+        help="Number of functions in the profile report (default: 15).",
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=0.005,
+        help="Seconds between samples of the sample profiler (default: 0.005).",
+    )
     subparsers = parser.add_subparsers(
         dest="command", required=True, help="Action to perform"
     )
 
+    # --- Shared game model options ---
+    model_options = argparse.ArgumentParser(add_help=False)
+    model_options.add_argument(
+        "--effect-cap",
+        type=int,
+        default=DEFAULT_EFFECT_CAP,
+        help=f"Most effects a product can hold; a full product gets no new base effects (default: {DEFAULT_EFFECT_CAP}, 0 for no cap). This changes which products can be made at all, unlike --max-effects.",
+    )
+
+    # --- Shared result cache options ---
+    cache_options = argparse.ArgumentParser(add_help=False)
+    cache_options.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Neither read nor store results in the result cache.",
+    )
+    cache_options.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Recompute the result and replace the cached one.",
+    )
+    cache_options.add_argument(
+        "--cache-path",
+        default=QUERY_CACHE_PATH,
+        help=f"Result cache file (default: {QUERY_CACHE_PATH}).",
+    )
+
     # --- Subparser: effects ---
     parser_effects = subparsers.add_parser(
-        "effects", help="Calculate the final effects of an ingredient sequence."
+        "effects",
+        help="Calculate the final effects of an ingredient sequence.",
+        parents=[model_options],
     )
     parser_effects.add_argument(
         "ingredients",
@@ -972,7 +5253,9 @@ def main():
 
     # --- Subparser: shortest ---
     parser_shortest = subparsers.add_parser(
-        "shortest", help="Find the shortest sequence to achieve target effects."
+        "shortest",
+        help="Find the shortest sequence to achieve target effects.",
+        parents=[model_options, cache_options],
     )
     parser_shortest.add_argument(
         "target_effects",
@@ -997,10 +5280,70 @@ def main():
         default=8,
         help="Maximum number of *additional* ingredients to try (default: 8).",
     )
+    parser_shortest.add_argument(
+        "--alternatives",
+        metavar="K",
+        type=int,
+        help="List the K shortest alternative recipes instead of a single one.",
+    )
+    parser_shortest.add_argument(
+        "--bidirectional",
+        action="store_true",
+        help="Search forward from the start and backward from the target at once (faster for deep targets).",
+    )
+    parser_shortest.add_argument(
+        "--exclude-effects",
+        metavar="EFFECT",
+        nargs="+",
+        default=None,
+        help="Effects the final product must not have.",
+    )
+    parser_shortest.add_argument(
+        "--ban-ingredients",
+        metavar="INGREDIENT",
+        nargs="+",
+        default=None,
+        help="Ingredients that may not be used.",
+    )
+    parser_shortest.add_argument(
+        "--max-effects",
+        type=int,
+        default=None,
+        help="Maximum number of effects the final product may have. Only filters the final product; intermediate products may hold more (see --effect-cap).",
+    )
+
+    # --- Subparser: strains ---
+    parser_strains = subparsers.add_parser(
+        "strains",
+        help="Find the shortest sequence for target effects from every purchasable strain at once.",
+        parents=[model_options],
+    )
+    parser_strains.add_argument(
+        "target_effects",
+        metavar="EFFECT",
+        nargs="+",
+        help="List of desired effects that must be present.",
+    )
+    parser_strains.add_argument(
+        "--strains",
+        metavar="STRAIN",
+        nargs="+",
+        choices=list(STRAIN_STARTING_EFFECTS.keys()),
+        default=None,
+        help=f"Strains to start from (default: all). Valid: {list(STRAIN_STARTING_EFFECTS.keys())}",
+    )
+    parser_strains.add_argument(
+        "--max-ingredients",
+        type=int,
+        default=8,
+        help="Maximum number of *additional* ingredients to try (default: 8).",
+    )
 
     # --- Subparser: expensive ---
     parser_expensive = subparsers.add_parser(
-        "expensive", help="Find the most expensive products."
+        "expensive",
+        help="Find the most expensive products.",
+        parents=[model_options, cache_options],
     )
     parser_expensive.add_argument(
         "base_product",
@@ -1016,6 +5359,129 @@ def main():
         default=10,
         help="Number of top results to display (default: 10).",
     )
+    parser_expensive.add_argument(
+        "--exclude-effects",
+        metavar="EFFECT",
+        nargs="+",
+        default=None,
+        help="Effects the final product must not have.",
+    )
+    parser_expensive.add_argument(
+        "--ban-ingredients",
+        metavar="INGREDIENT",
+        nargs="+",
+        default=None,
+        help="Ingredients that may not be used.",
+    )
+    parser_expensive.add_argument(
+        "--max-effects",
+        type=int,
+        default=None,
+        help="Maximum number of effects the final product may have. Only filters the final product; intermediate products may hold more (see --effect-cap).",
+    )
+    parser_expensive.add_argument(
+        "--save-states",
+        metavar="PATH",
+        help="Save the explored states to PATH for the reprice command (skips the result cache).",
+    )
+
+    # --- Subparser: reprice ---
+    parser_reprice = subparsers.add_parser(
+        "reprice",
+        help="Rank states saved by expensive --save-states under current or what-if prices.",
+        parents=[model_options],
+    )
+    parser_reprice.add_argument(
+        "states_file", help="File written by expensive --save-states."
+    )
+    parser_reprice.add_argument(
+        "--what-if",
+        metavar="FILE",
+        nargs="+",
+        default=None,
+        help='JSON files with "multipliers" and/or "base_prices" overrides, one scenario each.',
+    )
+    parser_reprice.add_argument(
+        "--products",
+        nargs="+",
+        choices=list(BASE_PRICES.keys()),
+        default=None,
+        help="Base products to rank for (default: all).",
+    )
+    parser_reprice.add_argument(
+        "--num-results",
+        type=int,
+        default=5,
+        help="Number of top results per base product (default: 5).",
+    )
+
+    # --- Subparser: cheapest ---
+    parser_cheapest = subparsers.add_parser(
+        "cheapest",
+        help="Find the cheapest sequence by ingredient cost, or the most profitable products.",
+        parents=[model_options],
+    )
+    parser_cheapest.add_argument(
+        "target_effects",
+        metavar="EFFECT",
+        nargs="*",
+        help="List of desired effects that must be present (optional with --profit).",
+    )
+    parser_cheapest.add_argument(
+        "--start-effects",
+        metavar="EFFECT",
+        nargs="*",
+        default=None,
+        help="Optional list of effects present before adding ingredients.",
+    )
+    parser_cheapest.add_argument(
+        "--product-name",
+        help="Optional name for the starting product if --start-effects are provided.",
+    )
+    parser_cheapest.add_argument(
+        "--max-ingredients",
+        type=int,
+        default=8,
+        help="Maximum number of *additional* ingredients to try (default: 8).",
+    )
+    parser_cheapest.add_argument(
+        "--profit",
+        metavar="BASE_PRODUCT",
+        choices=list(BASE_PRICES.keys()),
+        help="Maximize sell price minus ingredient cost for this base product instead.",
+    )
+    parser_cheapest.add_argument(
+        "--num-results",
+        type=int,
+        default=10,
+        help="Number of top results to display with --profit (default: 10).",
+    )
+
+    # --- Subparser: count ---
+    parser_count = subparsers.add_parser(
+        "count",
+        help="Count ingredient sequences and distinct products per length.",
+        parents=[model_options],
+    )
+    parser_count.add_argument(
+        "target_effects",
+        metavar="EFFECT",
+        nargs="*",
+        help="Effects a product must have to count as matching (default: any).",
+    )
+    parser_count.add_argument(
+        "--start-effects",
+        metavar="EFFECT",
+        nargs="*",
+        default=None,
+        help="Optional list of effects the product starts with.",
+    )
+    parser_count.add_argument(
+        "--max-ingredients",
+        type=int,
+        default=6,
+        help="Longest sequence length to count (default: 6).",
+    )
 
     # --- Subparser: price ---
     parser_price = subparsers.add_parser(
@@ -1033,11 +5499,216 @@ def main():
         help="List of final effects present in the product.",
     )
 
+    # --- Subparser: session ---
+    parser_session = subparsers.add_parser(
+        "session",
+        help="Mix interactively, one ingredient at a time, with undo.",
+        parents=[model_options],
+    )
+    parser_session.add_argument(
+        "--start-effects",
+        metavar="EFFECT",
+        nargs="*",
+        default=None,
+        help="Optional list of effects the product starts with.",
+    )
+    parser_session.add_argument(
+        "--product-name",
+        help="Optional name for the starting product if --start-effects are provided.",
+    )
+    parser_session.add_argument(
+        "--target",
+        metavar="EFFECT",
+        nargs="+",
+        default=None,
+        help="Target effects to show the shortest remaining path to.",
+    )
+    parser_session.add_argument(
+        "--max-ingredients",
+        type=int,
+        default=8,
+        help="Total ingredient limit for the remaining path (default: 8).",
+    )
+
+    # --- Subparser: suggest ---
+    parser_suggest = subparsers.add_parser(
+        "suggest",
+        help="Suggest the next ingredient leading to the highest price (uses a saved value table).",
+        parents=[model_options],
+    )
+    parser_suggest.add_argument(
+        "base_product",
+        choices=list(BASE_PRICES.keys()),
+        help="The base product, used for the prices shown.",
+    )
+    parser_suggest.add_argument(
+        "effects",
+        metavar="EFFECT",
+        nargs="*",
+        help="Effects of the product mixed so far (none for an unmixed product).",
+    )
+    parser_suggest.add_argument(
+        "--remaining",
+        type=int,
+        default=None,
+        help="Ingredients that may still be added (default: as many as the table covers).",
+    )
+    parser_suggest.add_argument(
+        "--table",
+        default=VALUE_TABLE_PATH,
+        help=f"Value table file, built on first use (default: {VALUE_TABLE_PATH}).",
+    )
+    parser_suggest.add_argument(
+        "--depth",
+        type=int,
+        default=None,
+        help="Depth to build the table to; rebuilds a table of another depth (default: 7).",
+    )
+    parser_suggest.add_argument(
+        "--rebuild", action="store_true", help="Rebuild the value table."
+    )
+
+    # --- Subparser: export-graph ---
+    parser_export = subparsers.add_parser(
+        "export-graph",
+        help="Stream the reachable state graph to a file.",
+        parents=[model_options],
+    )
+    parser_export.add_argument("output", help="The file to write.")
+    parser_export.add_argument(
+        "--format",
+        choices=GRAPH_FORMATS,
+        default=None,
+        help="Output format (default: from the extension, binary unless .ndjson or .graphml).",
+    )
+    parser_export.add_argument(
+        "--depth",
+        type=int,
+        default=4,
+        help="Ingredients to explore from the starting states (default: 4).",
+    )
+    parser_export.add_argument(
+        "--start-effects",
+        metavar="EFFECT",
+        nargs="*",
+        default=None,
+        help="Start from these effects instead of every purchasable strain.",
+    )
+
+    # --- Subparser: update-graph ---
+    parser_update_graph = subparsers.add_parser(
+        "update-graph",
+        help="Update a binary graph export after a rules or price change.",
+        parents=[model_options],
+    )
+    parser_update_graph.add_argument("graph", help="A binary graph export.")
+    parser_update_graph.add_argument(
+        "--output",
+        default=None,
+        help="Write the updated graph here instead of replacing the file.",
+    )
+
+    # --- Subparser: bench ---
+    parser_bench = subparsers.add_parser(
+        "bench",
+        help="Run the benchmark suite and compare against a baseline.",
+        parents=[model_options],
+    )
+    parser_bench.add_argument(
+        "--max-depth",
+        type=int,
+        default=5,
+        help="Deepest 'expensive' benchmark, from 3 (default: 5, 8 takes minutes).",
+    )
+    parser_bench.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Timed runs per benchmark, the best is kept (default: 3).",
+    )
+    parser_bench.add_argument(
+        "--only",
+        metavar="PREFIX",
+        nargs="+",
+        default=None,
+        help="Only run benchmarks whose name starts with PREFIX (e.g. shortest).",
+    )
+    parser_bench.add_argument(
+        "--baseline",
+        default=BENCH_BASELINE_PATH,
+        help=f"Baseline JSON to compare against (default: {BENCH_BASELINE_PATH}).",
+    )
+    parser_bench.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run as the new baseline.",
+    )
+    parser_bench.add_argument(
+        "--output",
+        default=None,
+        help="Also write this run's results to a JSON file.",
+    )
+    parser_bench.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown or memory growth reported as a regression (default: 0.2).",
+    )
+
+    # --- Subparser: verify ---
+    parser_verify = subparsers.add_parser(
+        "verify",
+        help="Check the fast engines against the reference implementation.",
+        parents=[model_options],
+    )
+    parser_verify.add_argument(
+        "--depth",
+        type=int,
+        default=4,
+        help="Depth of the exhaustive checks and search limit (default: 4).",
+    )
+    parser_verify.add_argument(
+        "--seed", type=int, default=0, help="Random seed (default: 0)."
+    )
+    parser_verify.add_argument(
+        "--random-sequences",
+        type=int,
+        default=200,
+        help="Random ingredient sequences for the transition check (default: 200).",
+    )
+    parser_verify.add_argument(
+        "--targets",
+        type=int,
+        default=20,
+        help="Random targets per strain for the shortest check (default: 20).",
+    )
+    parser_verify.add_argument(
+        "--checks",
+        nargs="+",
+        choices=VERIFY_CHECKS,
+        default=None,
+        help="Checks to run (default: all).",
+    )
+    parser_verify.add_argument(
+        "--engines",
+        metavar="ENGINE",
+        nargs="+",
+        default=None,
+        help="Only verify engines with these names.",
+    )
+
     # --- Parse Arguments ---
     if len(sys.argv) == 1:  # If run with no arguments, print help
         parser.print_help(sys.stderr)
         sys.exit(1)
     args = parser.parse_args()
+    if hasattr(args, "effect_cap"):
+        set_effect_cap(args.effect_cap)
+
+    profiler = None
+    if args.profile:
+        profiler = CommandProfiler(args.profiler, args.profile_interval)
+        profiler.start()
 
     # --- Execute Command ---
     try:  # Wrap in try block to catch validation errors during data loading if not caught earlier
@@ -1048,19 +5719,109 @@ def main():
             )
 
         elif args.command == "shortest":
-            find_shortest_product_sequence(
-                target_effects=args.target_effects,
-                starting_effects=args.start_effects,
+            query = dict(
+                target_effects=sorted(set(args.target_effects)),
+                starting_effects=sorted(set(args.start_effects or [])),
                 product_name=args.product_name,
                 max_ingredients=args.max_ingredients,
+                exclude_effects=sorted(set(args.exclude_effects or [])),
+                ban_ingredients=sorted(set(args.ban_ingredients or [])),
+                max_effects=args.max_effects,
+            )
+            if args.alternatives:
+                if args.bidirectional:
+                    parser.error("--bidirectional cannot be combined with --alternatives")
+                query["num_alternatives"] = args.alternatives
+                compute = lambda: find_alternative_product_sequences(**query)
+            else:
+                query["bidirectional"] = args.bidirectional
                 # debug_specific_sequence could be added as another arg if needed
+                compute = lambda: find_shortest_product_sequence(**query)
+            run_cached_query(
+                "alternatives" if args.alternatives else "shortest",
+                query,
+                compute,
+                cache_path=args.cache_path,
+                use_cache=not args.no_cache,
+                refresh=args.refresh,
+            )
+
+        elif args.command == "strains":
+            strains = None
+            if args.strains:
+                strains = {name: STRAIN_STARTING_EFFECTS[name] for name in args.strains}
+            find_shortest_sequences_for_strains(
+                target_effects=args.target_effects,
+                strains=strains,
+                max_ingredients=args.max_ingredients,
             )
 
         elif args.command == "expensive":
-            find_most_expensive_products(
+            query = dict(
                 base_product_name=args.base_product,
                 max_ingredients=args.max_ingredients,
                 num_results=args.num_results,
+                exclude_effects=sorted(set(args.exclude_effects or [])),
+                ban_ingredients=sorted(set(args.ban_ingredients or [])),
+                max_effects=args.max_effects,
+            )
+            if args.save_states:
+                find_most_expensive_products(**query, save_states=args.save_states)
+            else:
+                run_cached_query(
+                    "expensive",
+                    query,
+                    # Effect sets are stored as sorted lists
+                    lambda: [
+                        (price, sequence, sorted(effects))
+                        for price, sequence, effects in find_most_expensive_products(
+                            **query
+                        )
+                    ],
+                    cache_path=args.cache_path,
+                    use_cache=not args.no_cache,
+                    refresh=args.refresh,
+                    decode=lambda results: [
+                        (price, sequence, set(effects))
+                        for price, sequence, effects in results
+                    ],
+                )
+
+        elif args.command == "reprice":
+            run_repricing(
+                args.states_file,
+                what_if_paths=args.what_if,
+                base_products=args.products,
+                num_results=args.num_results,
+            )
+
+        elif args.command == "cheapest":
+            if args.profit:
+                find_most_profitable_products(
+                    base_product_name=args.profit,
+                    max_ingredients=args.max_ingredients,
+                    num_results=args.num_results,
+                    target_effects=args.target_effects,
+                    starting_effects=args.start_effects,
+                    product_name=args.product_name,
+                )
+            elif not args.target_effects:
+                print(
+                    f"{C_RED}Error: Provide target effects, or --profit BASE_PRODUCT.{C_RESET}"
+                )
+            else:
+                find_cheapest_product_sequence(
+                    target_effects=args.target_effects,
+                    starting_effects=args.start_effects,
+                    product_name=args.product_name,
+                    max_ingredients=args.max_ingredients,
+                )
+
+        elif args.command == "count":
+            print_recipe_counts(
+                target_effects=args.target_effects,
+                starting_effects=args.start_effects,
+                max_ingredients=args.max_ingredients,
             )
 
         elif args.command == "price":
@@ -1094,6 +5855,59 @@ def main():
                         f"  {Style.BRIGHT}Calculated Price: {C_GREEN}${final_price}{C_RESET}"
                     )
 
+        elif args.command == "session":
+            run_mixing_session(
+                starting_effects=args.start_effects,
+                product_name=args.product_name,
+                target_effects=args.target,
+                max_ingredients=args.max_ingredients,
+            )
+
+        elif args.command == "suggest":
+            table = load_or_build_value_table(args.table, args.depth, args.rebuild)
+            suggest_next_ingredient(
+                base_product_name=args.base_product,
+                current_effects=args.effects,
+                remaining=args.remaining,
+                table=table,
+            )
+
+        elif args.command == "export-graph":
+            export_state_graph(
+                output_path=args.output,
+                output_format=args.format,
+                depth=args.depth,
+                starting_effects=args.start_effects,
+            )
+
+        elif args.command == "update-graph":
+            update_state_graph(args.graph, args.output)
+
+        elif args.command == "bench":
+            regressions = run_benchmarks(
+                max_depth=args.max_depth,
+                repeat=args.repeat,
+                only=args.only,
+                baseline_path=args.baseline,
+                save_baseline=args.save_baseline,
+                output_path=args.output,
+                threshold=args.threshold,
+            )
+            if regressions:
+                sys.exit(1)
+
+        elif args.command == "verify":
+            failure = run_verification(
+                max_depth=args.depth,
+                seed=args.seed,
+                num_random=args.random_sequences,
+                num_targets=args.targets,
+                checks=args.checks,
+                engines=args.engines,
+            )
+            if failure is not None:
+                sys.exit(1)
+
     except ValueError as e:
         print(f"\n{Back.RED}{Style.BRIGHT}Runtime Error:{C_RESET} {C_RED}{e}{C_RESET}")
         sys.exit(1)
@@ -1103,6 +5917,12 @@ def main():
         )
 
         sys.exit(1)
+    finally:
+        # Also reached on sys.exit, e.g. a failed bench or verify
+        if profiler is not None:
+            profiler.stop()
+            path = profiler.save(args.profile_output)
+            print_profile_report(profiler, path, args.profile_top)
 
 
 if __name__ == "__main__":